@@ -0,0 +1,76 @@
+import ast
+import sys
+import os
+from timeit import timeit
+import main
+
+# Example candidates from main.py, plus any of the input files that are present.
+EXAMPLES = [
+    "str.split(sep)[1:3]",
+    "str[1:3]",
+    "str[lo[1]:3]",
+    "str[lo[2]:3]",
+    "(str + str)[1:3]",
+    "(str + str1)[1:3]",
+    "(str2 + str)[1:3]",
+    "str[1:3]",
+    "str[1:len('a')]",
+    "str[1:len('b')]",
+    "str[2:1]",
+    "str.split(sep)[1:3]",
+    "str.split(sep)[1:2]",
+    "str.split(sep)[0]",
+    "str.split(sep)[1]",
+    "str.split(sep)[2]",
+    "str.split(sep)[lo[1]]",
+    "str.split(sep)[lo[2]]",
+]
+INPUT_FILES = ["input-file.txt", "input-file2.txt", "ex-input.txt"]
+
+def quadratic_group_by_str(l):
+    d = {}
+    for el in l:
+        result = list(filter(lambda x: ast.unparse(el) == ast.unparse(x), list(d.keys())))
+        if result:
+            d[result[0]].append(el)
+        else:
+            d.setdefault(el, []).append(el)
+    return d
+
+def quadratic_generate_color_tups(d, trees):
+    new_l = []
+    for tree in trees:
+        color = [k for k,v in d.items() if tree in v][0]
+        new_l.append((color, ast.unparse(tree)))
+    return new_l
+
+def load_inputs(file_names):
+    inputs = {"examples": [ast.parse(x) for x in EXAMPLES]}
+    for file_name in file_names:
+        if os.path.exists(file_name):
+            inputs[file_name] = main.read_file(file_name)
+    return inputs
+
+def check(name, trees, number):
+    # Group by the root sketch, as the home page does.
+    groups, _ = main.trees_uppper_bounds(trees)
+    color_dict = main.assign_colors(groups) if len(groups) <= 6 else {f"group-{i}": v for i, v in enumerate(groups.values())}
+    pairs = [
+        ("group_by_str", lambda: quadratic_group_by_str(trees), lambda: main.group_by_str(trees)),
+        ("generate_color_tups", lambda: quadratic_generate_color_tups(color_dict, trees), lambda: main.generate_color_tups(color_dict, trees)),
+    ]
+    ok = True
+    for func_name, old, new in pairs:
+        same = old() == new()
+        ok = ok and same
+        old_time = timeit(old, number=number) / number
+        new_time = timeit(new, number=number) / number
+        print(f"{name:>16} {func_name:<20} n={len(trees):<6} same={same} old={old_time * 1e3:.2f}ms new={new_time * 1e3:.2f}ms")
+    return ok
+
+if __name__ == "__main__":
+    inputs = load_inputs(sys.argv[1:] or INPUT_FILES)
+    # Repeat the inputs so the quadratic versions show.
+    inputs["examples x50"] = [ast.parse(x) for x in EXAMPLES * 50]
+    ok = all([check(name, trees, 5) for name, trees in inputs.items()])
+    sys.exit(0 if ok else 1)
@@ -1,8 +1,8 @@
 import ast
+import hashlib
 from itertools import zip_longest, combinations, product, starmap, groupby
 from collections import OrderedDict
-from typing import Any, AnyStr
-import copy
+from typing import Any, AnyStr, NamedTuple
 from flask import Flask, render_template, redirect, url_for
 from flask_restful import Api, Resource, reqparse, abort, fields, marshal_with
 from flask_sqlalchemy import SQLAlchemy
@@ -12,88 +12,53 @@ api = Api(app)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
 db = SQLAlchemy(app)
 
-class TreeCollector(ast.NodeVisitor):
-    def __init__(self) -> None:
-        super().__init__()
-        self.nodes: list[ast.AST] = []
-
-    def generic_visit(self, node: ast.AST) -> None:
-        self.nodes.append(node)
-        return super().generic_visit(node)
-
-    def collect(self, tree: ast.AST) -> list[ast.AST]: 
-        # Reset nodes. 
-        self.visit(tree)
-        return self.nodes
-
-class HoleCollector(ast.NodeVisitor):
-    def __init__(self) -> None:
-        super().__init__()
-        self.holes: list[ast.AST] = []
-
-    def generic_visit(self, node: ast.AST) -> None:
-        if (isinstance(node, ast.Name) and node.id == '?'):
-            self.holes.append(node)
-        return super().generic_visit(node)
-
-    def collect(self, tree: ast.AST) -> list[ast.AST]: 
-        # Reset nodes. 
-        self.visit(tree)
-        return self.holes
-
-class TreeMarker(ast.NodeVisitor):
-    def visit(self, node: ast.AST) -> ast.AST:
-        node.marked = False
-        return super().visit(node)
-
-class TreeGeneralizer(ast.NodeTransformer):
+# Hole that intermediate sketches are counted under. 
+HOLE = ast.Name(id='?', ctx=ast.Load())
+
+class TreeGeneralizer:
+    # Builds the sketch in one pass: del_dict keys become holes, untouched 
+    # subtrees are shared with the input tree, and the input is never modified. 
     def __init__(self, del_dict: dict[ast.AST, list[ast.AST]]) -> None:
         self.holes = []
         self.del_dict = del_dict
         self.counter = 0
 
     def visit(self, node: ast.AST) -> Any:
-        method = 'visit_' + node.__class__.__name__
-        visitor = getattr(self, method, self.generic_visit)
-        return visitor(node)
-
-    def visit_Module(self, node: ast.AST) -> Any:
         # Cannot remove modules.
-        return super().generic_visit(node)
-    
-    def generic_visit(self, node: ast.AST) -> Any:
+        if node in self.del_dict and not isinstance(node, ast.Module):
+            return self.make_hole(node)
+        changed = False
+        fields = {}
+        for name, value in ast.iter_fields(node):
+            if isinstance(value, ast.AST):
+                new_value = self.visit(value)
+            elif isinstance(value, list):
+                new_value = [self.visit(x) if isinstance(x, ast.AST) else x for x in value]
+                if all(a is b for a, b in zip(new_value, value)):
+                    new_value = value
+            else:
+                new_value = value
+            changed = changed or new_value is not value
+            fields[name] = new_value
+        if not changed:
+            return node
+        new_node = type(node)(**fields)
+        for attr in node._attributes:
+            if hasattr(node, attr):
+                setattr(new_node, attr, getattr(node, attr))
+        return new_node
+
+    def make_hole(self, node: ast.AST) -> ast.AST:
         hole = ast.Name(id=f'?', ctx="")
         hole.hole_id = self.counter + 1
-        if node.marked:
-            for k,v in self.del_dict.items(): 
-                if (is_equal(k, node)):
-                    if all(isinstance(item, type(k)) for item in v):
-                        common_type = extract_common_type(k)
-                        hole = ast.Name(id=f'{common_type}?', ctx="")
-            # Increment id for next hole. 
-            self.counter += 1
-            return hole
-        return super().generic_visit(node)
-
-class HoleInserter(ast.NodeTransformer):
-    def __init__(self, to_insert) -> None:
-        self.holes = []
-        self.to_insert = to_insert
-
-    def visit(self, node: ast.AST) -> Any:
-        method = 'visit_' + node.__class__.__name__
-        visitor = getattr(self, method, self.generic_visit)
-        return visitor(node)
-
-    def visit_Module(self, node: ast.AST) -> Any:
-        # Cannot remove modules.
-        return super().generic_visit(node)
-    
-    def generic_visit(self, node: ast.AST) -> Any:
-        if node.marked:
-            # print("Retuning hole... ", type(node), ast.unparse(node))
-            return self.to_insert
-        return super().generic_visit(node)
+        if all(isinstance(item, type(node)) for item in self.del_dict[node]):
+            common_type = extract_common_type(node)
+            hole = ast.Name(id=f'{common_type}?', ctx="")
+        if hole.id == '?':
+            self.holes.append(hole)
+        # Increment id for next hole. 
+        self.counter += 1
+        return hole
 
 def my_eval(tree):
     if isinstance(tree, ast.slice):
@@ -139,18 +104,34 @@ def group_trees_by_type(trees):
             typed_lists.setdefault(type(tree), []).append(tree)
     return typed_lists
 
+def fingerprint(node) -> int:
+    # Merkle-style structural hash: equal structures always share it, whatever was seen before. 
+    if isinstance(node, ast.AST):
+        fp = getattr(node, 'fingerprint', None)
+        if fp is None:
+            fp = node.fingerprint = key_fingerprint((type(node),) + tuple(fingerprint(getattr(node, k, None)) for k in node._fields if k != 'ctx'))
+        return fp
+    if isinstance(node, list):
+        return key_fingerprint((list,) + tuple(fingerprint(x) for x in node))
+    return key_fingerprint((type(node), node))
+
+def key_fingerprint(key) -> int:
+    # Digest of a structural key: a node type or list and the fingerprints of its fields, 
+    # or a primitive's type and value (repr keeps 0.0 and -0.0 apart). 
+    kind = key[0]
+    if kind is list or issubclass(kind, ast.AST):
+        data = b"".join(fp.to_bytes(16, 'big') for fp in key[1:])
+    else:
+        data = repr(key[1]).encode('utf-8', 'surrogatepass')
+    digest = hashlib.blake2b(kind.__name__.encode() + b"\0", digest_size=16)
+    digest.update(data)
+    return int.from_bytes(digest.digest(), 'big')
+
 def is_equal(node1, node2):
     if type(node1) is not type(node2):
         return False
-    if isinstance(node1, ast.AST):
-        for k, v in vars(node1).items():
-            if k in ('lineno', 'col_offset', 'ctx'):
-                continue
-            if not is_equal(v, getattr(node2, k)):
-                return False
-        return True
-    elif isinstance(node1, list):
-        return all(starmap(is_equal, zip(node1, node2)))
+    if isinstance(node1, (ast.AST, list)):
+        return fingerprint(node1) == fingerprint(node2)
     else:
         return node1 == node2
 
@@ -173,6 +154,15 @@ def extract_common_type(a) -> str:
     else:
         print("Testing HERE... ", type(a))
 
+def bare_mismatch(head, rest) -> bool:
+    # Whether values differ where some side is not a node (None or a primitive, 
+    # such as an attribute name), looking into lists item by item. 
+    if isinstance(head, list) and all(isinstance(t, list) for t in rest):
+        return any(bare_mismatch(items[0], list(items[1:])) for items in zip_longest(head, *rest))
+    if all(isinstance(t, type(head)) for t in rest):
+        return not isinstance(head, ast.AST) and any(t != head for t in rest)
+    return not isinstance(head, ast.AST) or not all(isinstance(t, ast.AST) for t in rest)
+
 def compare_trees(head: ast.AST, rest: list[ast.AST], del_dict: OrderedDict[ast.AST, list[ast.AST]]):
     # print("Comparing... ", ast.unparse(head), list(map(lambda x: ast.unparse(x), rest)))
     if not all(isinstance(t, type(head)) for t in rest):
@@ -181,6 +171,11 @@ def compare_trees(head: ast.AST, rest: list[ast.AST], del_dict: OrderedDict[ast.
         return del_dict
 
     if isinstance(head, ast.AST):
+        # Identical subtrees cannot open a hole. 
+        head_fp = fingerprint(head)
+        if all(fingerprint(t) == head_fp for t in rest):
+            return del_dict
+
         if (isinstance(head, ast.Name) and any(isinstance(t, ast.Name) and (t.id != head.id) for t in rest)):
             # print("Name mismatch! ", ast.unparse(head), head)
             del_dict[head] = rest
@@ -198,8 +193,14 @@ def compare_trees(head: ast.AST, rest: list[ast.AST], del_dict: OrderedDict[ast.
                 del_dict[head] = rest
                 return del_dict
 
+        # A field that differs without a node on every side (a missing list item or 
+        # slice step, a primitive) cannot be a hole of its own; the node is the hole. 
+        if any(bare_mismatch(getattr(head, k, None), [getattr(t, k, None) for t in rest]) for k in head._fields if k != 'ctx'):
+            del_dict[head] = rest
+            return del_dict
+
         for k,v in vars(head).items():
-            if k in {"lineno", "end_lineno", "col_offset", "end_col_offset", "ctx", "marked"}:
+            if k in {"lineno", "end_lineno", "col_offset", "end_col_offset", "ctx", "fingerprint"}:
                     continue
             # print("Here: ", v, head)
             compare_trees(v, list(map(lambda t: getattr(t, k), rest)), del_dict)
@@ -212,16 +213,96 @@ def compare_trees(head: ast.AST, rest: list[ast.AST], del_dict: OrderedDict[ast.
     # Return statement. 
     return del_dict
 
+class PatternGeneralizer(TreeGeneralizer):
+    # Replaces one subexpression with a plain hole, so the sketch has the 
+    # fingerprint the miner counted it under. 
+    def make_hole(self, node: ast.AST) -> ast.AST:
+        self.counter += 1
+        hole = ast.Name(id='?', ctx=ast.Load())
+        hole.hole_id = self.counter
+        self.holes.append(hole)
+        return hole
+
+class IntermediateSketch(NamedTuple):
+    # Same shape as a ReverseSketch with one hole: substitutions[i] fills the 
+    # hole for trees[i], which stands for counts[i] candidates. 
+    sketch_AST: ast.AST
+    sketch: str
+    hole: ast.AST
+    trees: list
+    substitutions: list
+    counts: list
+
+    @property
+    def support(self) -> int:
+        return sum(self.counts)
+
+def holed_fingerprints(node: ast.AST) -> list:
+    # (fingerprint of node with one subexpression replaced by a hole, that subexpression) 
+    # for every subexpression. Only the keys along the path to the hole are rebuilt. 
+    holed = []
+    fields = [k for k in node._fields if k != 'ctx']
+    fps = [fingerprint(getattr(node, k, None)) for k in fields]
+    for i, k in enumerate(fields):
+        value = getattr(node, k, None)
+        if isinstance(value, ast.AST):
+            child = holed_fingerprints(value)
+        elif isinstance(value, list):
+            item_fps = [fingerprint(x) for x in value]
+            child = []
+            for j, item in enumerate(value):
+                if not isinstance(item, ast.AST):
+                    continue
+                for fp, sub in holed_fingerprints(item):
+                    # f-string parts cannot be unparsed as a plain name. 
+                    if sub is item and isinstance(node, ast.JoinedStr):
+                        continue
+                    child.append((key_fingerprint((list,) + tuple(item_fps[:j]) + (fp,) + tuple(item_fps[j + 1:])), sub))
+        else:
+            continue
+        head, tail = (type(node),) + tuple(fps[:i]), tuple(fps[i + 1:])
+        for fp, sub in child:
+            holed.append((key_fingerprint(head + (fp,) + tail), sub))
+    if isinstance(node, ast.expr):
+        holed.append((fingerprint(HOLE), node))
+    return holed
+
+def mine_intermediate_sketches(trees, min_support=2) -> list[IntermediateSketch]:
+    # One-hole patterns shared by at least min_support candidates, found by counting 
+    # holed fingerprints in one pass per distinct tree instead of comparing every pair. 
+    distinct = {}
+    for tree in trees:
+        distinct.setdefault(fingerprint(tree), []).append(tree)
+    first = {}
+    patterns = {}
+    for same_trees in distinct.values():
+        tree = same_trees[0]
+        # A hole over a whole statement matches everything. 
+        tops = {id(stmt.value) for stmt in getattr(tree, 'body', []) if isinstance(stmt, ast.Expr)}
+        for fp, sub in holed_fingerprints(tree):
+            if id(sub) in tops:
+                continue
+            occurrence = (tree, sub, len(same_trees))
+            seen = first.setdefault(fp, occurrence)
+            if seen is not occurrence:
+                patterns.setdefault(fp, [seen]).append(occurrence)
+    intermediate_sketches = []
+    for fp, occurrences in patterns.items():
+        counts = [n for _, _, n in occurrences]
+        if sum(counts) < min_support:
+            continue
+        tree, sub, _ = occurrences[0]
+        generalizer = PatternGeneralizer({sub: []})
+        sketch_AST = generalizer.visit(tree)
+        intermediate_sketches.append(IntermediateSketch(sketch_AST, ast.unparse(sketch_AST), generalizer.holes[0],
+                                                        [t for t, _, _ in occurrences], [s for _, s, _ in occurrences], counts))
+    intermediate_sketches.sort(key=lambda x: x.support, reverse=True)
+    return intermediate_sketches
+
 def generalize_tree(tree, del_dict):
-    TreeMarker().visit(tree)
-    tree_nodes = TreeCollector().collect(tree)
-    for node in del_dict:
-        idx = tree_nodes.index(node)
-        tree_nodes[idx].marked = True
-    head_tree_copy = copy.deepcopy(tree)
-    TreeGeneralizer(del_dict).visit(head_tree_copy)
-    holes_loc = HoleCollector().collect(head_tree_copy)
-    return head_tree_copy, ast.unparse(head_tree_copy), holes_loc
+    generalizer = TreeGeneralizer(del_dict)
+    generalized_tree = generalizer.visit(tree)
+    return generalized_tree, ast.unparse(generalized_tree), generalizer.holes
 
 def get_holes_from_user():
     lst = []
@@ -309,32 +390,22 @@ def trees_uppper_bounds(trees):
         #     print(opts)
     return grouped_dict, reverse_sketches
 
-def find_intermediate_sketches(trees, hole=0):
+def find_intermediate_sketches(trees, min_support=2):
     upperbound = trees_uppper_bounds_no_expand(trees)
     print(list(upperbound.keys())[0])
 
-    intermediate_values = dict()
-    for c in combinations(trees, 2):
-        del_dict = compare_trees(c[0], c[1:], {})
-        if del_dict:
-            key = list(del_dict)[hole]
-            updated_del_dict = { key: del_dict[key] }
-            _, reverse_sketch, _ = generalize_tree(c[0], updated_del_dict)
-            # print(reverse_sketch)
-            intermediate_values.setdefault(reverse_sketch, []).extend(c)
-    for inter in intermediate_values:
-        print(inter)
+    intermediate_sketches = mine_intermediate_sketches(trees, min_support)
+    for inter in intermediate_sketches:
+        print(inter.support, inter.sketch)
+    return intermediate_sketches
 
 def group_by_str(l):
+    # Elements with the same source, keyed by the first of them; one unparse per element. 
     d = {}
+    firsts = {}
     for el in l: 
-        result = list(filter(lambda x: ast.unparse(el) == ast.unparse(x), list(d.keys())))
-        # print("Unparsed: ", ast.unparse(el))
-        if result: 
-            d[result[0]].append(el)
-        else: 
-            d.setdefault(el, []).append(el)
-    # print("Grouped by str: ", d)
+        first = firsts.setdefault(ast.unparse(el), el)
+        d.setdefault(first, []).append(el)
     return d
 
 def convert_tups_to_dict(l):
@@ -370,15 +441,29 @@ def assign_colors(d):
     return new_d
 
 def generate_color_tups(d, trees):
+    # <tree id, color of the first group holding it>. 
+    colors = {}
+    for k,v in d.items():
+        for tree in v:
+            colors.setdefault(id(tree), k)
     new_l = []
     for tree in trees: 
-        color = [k for k,v in d.items() if tree in v][0]
-        new_l.append((color, ast.unparse(tree)))
+        new_l.append((colors[id(tree)], ast.unparse(tree)))
     return new_l
     
 def read_file(file_name) -> list[ast.AST]:
+    trees = []
+    # Stream the file, and skip lines that don't parse instead of failing the whole load. 
     with open(file_name) as f:
-        return [ast.parse(line.strip()) for line in f.readlines()]
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                trees.append(ast.parse(line))
+            except SyntaxError as e:
+                print(f"Skipping line {line_no} of {file_name}: {e.msg}")
+    return trees
 
 @app.route('/')
 def main():
@@ -1,27 +1,123 @@
 
 import ast
-import copy
+import click
+import hashlib
+import logging
+import mmap
+import os
+import secrets
+import struct
+import sys
+import threading
+import time
 
 from typing import Any
 from collections import OrderedDict, defaultdict
-from itertools import zip_longest, combinations, groupby
-from flask import Flask, jsonify, abort, make_response, render_template
+from collections.abc import Mapping, Sequence
+from functools import partial, wraps
+from itertools import zip_longest, combinations, groupby, count, repeat
+from array import array
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from flask import Flask, jsonify, abort, make_response, render_template, request, session, g, url_for
+
+logger = logging.getLogger(__name__)
 
 # TODO: Turn into a classes. 
 ID_COUNTER = 0
 COLORS = ["#ccf1ff", "#E0D7FF", "#FFCCE1", "#FAFFC7", "#ffcaaf", "#f1ffc4"]
+# Node attributes that never take part in a structural comparison. 
+IGNORED_FIELDS = {"lineno", "end_lineno", "col_offset", "end_col_offset", "ctx", "marked", "fingerprint", "original"}
+# Most entries kept by the group key and unparse tables; the least recently used go first. 
+GROUP_KEYS_SIZE = 1_000_000
+UNPARSED_SIZE = 1_000_000
+# Anti-unification engine used when none is given: "recursive" or "columnar". 
+ANTIUNIFY_ENGINE = "recursive"
+# Worker processes used to anti-unify the root groups; None runs them in-process. 
+ANTIUNIFY_WORKERS = None
+# Rename bound identifiers to positional placeholders before grouping. 
+ALPHA_RENAME = False
+# Most (sketch, hole) expansions kept in memory at once. 
+EXPANSION_CACHE_SIZE = 256
+# Most sketches a session's history keeps before evicting unpinned ones. 
+HISTORY_SIZE = 4096
+# Threads expanding the holes of the viewed sketch before they are clicked (0 disables 
+# prefetching), and how many sketches of a page are prefetched: the viewed one, then its top options. 
+PREFETCH_WORKERS = 2
+PREFETCH_SKETCHES = 4
+# Threads running background candidate loads, and how many finished loads are remembered. 
+JOB_WORKERS = 1
+JOBS_SIZE = 64
+# Most session workspaces kept in memory; the least recently used is dropped. 
+WORKSPACES_SIZE = 64
+# Candidate lines parsed per chunk, and worker processes parsing chunks; None parses in-process. 
+PARSE_CHUNK_SIZE = 2048
+PARSE_WORKERS = None
+# Candidate programs, and the memory-mapped store of their root sketches. 
+CANDIDATES_FILE = "ex-input.txt"
+SKETCH_STORE_FILE = "ex-input.sketches"
+# How far below the root sketches the snapshot precomputes hole options and 
+# refinements, and how many sketches it may hold; 0 stores the roots only. 
+LATTICE_DEPTH = 2
+LATTICE_MAX_NODES = 4096
 
 class ReverseSketch:
-    def __init__(self, sketch_id, sketch_AST, trees, holes, substitutions):
+    __slots__ = ('id', 'sketch_AST', 'trees', 'counts', 'sub_table', 'sub_lookup', 'sub_ids',
+                 'clickable_sketch', 'holes', 'parent_data', 'children', 'hole_index', 'ids', 'lattice')
+
+    def __init__(self, sketch_id, sketch_AST, trees, holes, substitutions, counts=None, ids=None):
         self.id = sketch_id
+        # Source of ids for the sketches expanded from this one; None uses ID_COUNTER. 
+        self.ids = ids
         self.sketch_AST = sketch_AST
         self.trees = trees
-        self.subs = substitutions
+        # How many candidate programs each (deduplicated) tree stands for. 
+        self.counts = counts if counts is not None else [1] * len(trees)
+        # Distinct substitution subexpressions, and <fingerprint, index in the table>. 
+        self.sub_table = []
+        self.sub_lookup = {}
+        # Holes x trees matrix of indices into sub_table; substitutions has one row of nodes per hole. 
+        self.sub_ids = [array('I', map(self.intern_substitution, row)) for row in substitutions]
         # x_0, ... , x_n for each hole. 
         self.clickable_sketch = None
         self.holes = holes 
         self.parent_data = {}
         self.children = []
+        # Per hole: <substitution id, ids of the trees with it>; built on first use. 
+        self.hole_index = None
+        # (store, node number) of a sketch precomputed in the snapshot lattice, or None. 
+        self.lattice = None
+
+    '''
+    Add a subexpression to the substitution table, once per distinct structure. 
+    @param subexpression AST. 
+    @return its index in the table. 
+    '''
+    def intern_substitution(self, node) -> int:
+        fp = fingerprint(node)
+        sub_id = self.sub_lookup.get(fp)
+        if sub_id is None:
+            sub_id = self.sub_lookup[fp] = len(self.sub_table)
+            self.sub_table.append(node)
+        return sub_id
+
+    '''
+    The substitution of a tree for a hole. 
+    @param hole number, tree id. 
+    @return subexpression AST. 
+    '''
+    def substitution(self, hole_num: int, tree_id: int):
+        return self.sub_table[self.sub_ids[hole_num][tree_id]]
+
+    '''
+    Substitutions as one <x_i, AST> dictionary per tree. Materialized on each 
+    access; meant for debugging and for diffing engines, not for hot paths. 
+    @param 
+    @return list of <x_i, AST>
+    '''
+    @property
+    def subs(self):
+        return [{hole: self.substitution(hole_num, tree_id) for hole_num, hole in enumerate(self.holes)} for tree_id in range(len(self.trees))]
 
     '''
     Update the parent data. 
@@ -48,7 +144,8 @@ class ReverseSketch:
     @return 
     '''
     def update_children(self, children):
-        self.children.extend(children)
+        # Revisited holes reuse their children. 
+        self.children.extend(child for child in children if child not in self.children)
 
     '''
     Update the clickable sketch. 
@@ -58,22 +155,49 @@ class ReverseSketch:
     def update_clickable_sketch(self, clickable_sketch):
         self.clickable_sketch = clickable_sketch
 
+    '''
+    Build the inverted index from each hole's substitutions to tree ids, once. 
+    @param 
+    @return list (one per hole) of <substitution id, list of tree ids>
+    '''
+    def get_hole_index(self):
+        hole_index = self.hole_index
+        if hole_index is None:
+            # Prefetch threads share the sketch, so publish the index only once it is complete. 
+            hole_index = []
+            for row in self.sub_ids:
+                index = dict()
+                for tree_id, sub_id in enumerate(row):
+                    index.setdefault(sub_id, []).append(tree_id)
+                hole_index.append(index)
+            self.hole_index = hole_index
+        return hole_index
+
+    '''
+    Find the ids of the trees whose substitution for a hole is one of the options. 
+    @param hole number, hole option ASTs.
+    @return sorted list of tree ids. 
+    '''
+    def option_tree_ids(self, hole_num: int, selected_hole_options: list[ast.AST]) -> list[int]:
+        index = self.get_hole_index()[hole_num]
+        selected_ids = {self.sub_lookup.get(fingerprint(x)) for x in selected_hole_options}
+        return sorted(tree_id for sub_id in selected_ids for tree_id in index.get(sub_id, ()))
+
     '''
     Find all of the original trees that have any of the substitutions. 
     @param 
     @return a list of original ASTs; the entire tree, not the subtree. 
     '''
-    def recover_groups(self, hole_num: int, selected_hole_options: list[ast.AST]):
-        print("Selected hole options: ", selected_hole_options)
+    def recover_groups(self, hole_num: int, selected_hole_options: list[ast.AST], see_counts: bool = False):
+        logger.debug("Selected hole options: %s", selected_hole_options)
+        # Options are deduplicated, so match them structurally, through the index. 
+        tree_ids = self.option_tree_ids(hole_num, selected_hole_options)
         # Store the trees that satisfy that have the selected sub-expression. 
-        valid_tree = []
-        for tree_id, tree in enumerate(self.trees):
-            # The substitution of the current tree for x_i. 
-            tree_substitution = self.subs[tree_id][f"x_{hole_num}"]
-            # If the substition is in the selected hole_options list, add it. 
-            if tree_substitution in selected_hole_options:
-                valid_tree.append(tree)
-        # Return all of the valid trees. 
+        valid_tree = [self.trees[tree_id] for tree_id in tree_ids]
+        valid_counts = [self.counts[tree_id] for tree_id in tree_ids]
+        # Return all of the valid trees, and sometimes how many programs each stands for. 
+        if see_counts:
+            return valid_tree, valid_counts
         return valid_tree
 
     '''
@@ -83,79 +207,177 @@ class ReverseSketch:
     '''
     def generate_groups(self, hole_num: int): 
         groups = dict()
-        for tree_id, tree in enumerate(self.trees):
-            hole_option_str = ast.unparse(self.subs[tree_id][f"x_{hole_num}"])
-            groups.setdefault(hole_option_str, []).append(tree)
+        # One unparse per distinct substitution. 
+        for sub_id, tree_ids in self.get_hole_index()[hole_num].items():
+            hole_option_str = unparse(self.sub_table[sub_id])
+            groups.setdefault(hole_option_str, []).extend(self.trees[tree_id] for tree_id in tree_ids)
         return groups
 
     '''
-    Expand a single hole. 
+    Expand a single hole. Expansions are memoized in EXPANSION_CACHE without 
+    ids; the options are numbered here, when a request first shows them. 
     @param 
     @return AST options for each hole. 
     '''
     def expand_hole(self, hole_num: int, see_groups: bool = False):
-        # Global variable
-        global ID_COUNTER
-        # Generate the hole id based on the provided hole number. 
-        hole_id = f"x_{hole_num}"
-        print("Myself: ", self)
-        # Array to store the options for the expanded hole. 
-        hole_options = []
+        group_dict, reverse_sketches = EXPANSION_CACHE.get(self, hole_num)
+        for reverse_sketch in reverse_sketches:
+            if reverse_sketch.id is None:
+                reverse_sketch.id = self.next_id()
+        # Return the revrse sketches, and sometimes the grouped hole_options. 
+        if see_groups:
+            return group_dict, reverse_sketches
+        else:
+            return reverse_sketches
+
+    '''
+    Anti-unify the options of a single hole, bypassing the cache. 
+    @param hole number, whether to number the options (else their id is None). 
+    @return grouped hole options, and the reverse sketches that represent them. 
+    '''
+    def compute_expansion(self, hole_num: int, numbered: bool = True):
+        ids = self.ids if numbered else repeat(None)
         # If there are not substitutions, this is a concrete program.
-        print("Checking my subs: ", self.subs)
-        if self.subs == [{}]:
-            print("In here...")
-            if see_groups: 
-                to_return = {type(self.sketch_AST): [self]}, [self]
-                print("To return: ", to_return)
-                return to_return
-            else:
-                return [self]
+        if len(self.trees) == 1 and not self.holes:
+            return {type(self.sketch_AST): [self]}, [self]
         # There isn't a hole there anymore. 
-        elif hole_id not in self.holes:
-            print("Im in here!")
+        elif not 0 <= hole_num < len(self.holes):
             # Generate a list of grouped programs and reverse sketches that represent the grouped programs. 
-            group_dict, reverse_sketches = trees_uppper_bounds(self.trees)
-             # Return the revrse sketches, and sometimes the grouped hole_options. 
-            if see_groups:
-                return group_dict, reverse_sketches
-            else:
-                return reverse_sketches
+            group_dict, reverse_sketches = trees_uppper_bounds(self.trees, counts=self.counts, ids=ids)
+        # The options were precomputed in the snapshot. 
+        elif self.lattice is not None and self.lattice[0].expansion(self.lattice[1], hole_num) is not None:
+            store, node_num = self.lattice
+            option_nodes, _ = store.expansion(node_num, hole_num)
+            reverse_sketches = [store.sketch(option_node, ids) for option_node in option_nodes]
+            group_dict = {store.group_key(option_node): reverse_sketch.trees for option_node, reverse_sketch in zip(option_nodes, reverse_sketches)}
         # Traverse the list of trees.
         else: 
-            for tree_id, tree in enumerate(self.trees): 
-                # The substitution of the current tree for x_i. 
-                print("Trying to get substitutions for: ", self)
-                tree_substitution = self.subs[tree_id][hole_id]
-                print("Tree substitution: ", tree_substitution, " for: ", self)
-                # Add the substitution to the list of options.
-                hole_options.append(tree_substitution) 
+            # Each distinct substitution is an option, weighted by the trees that have it. 
+            hole_options = []
+            option_counts = []
+            for sub_id, tree_ids in self.get_hole_index()[hole_num].items():
+                hole_options.append(self.sub_table[sub_id])
+                option_counts.append(sum(self.counts[tree_id] for tree_id in tree_ids))
             # Generate a list of grouped programs and reverse sketches that represent the grouped programs. 
-            group_dict, reverse_sketches = trees_uppper_bounds(hole_options)
-            # Return the revrse sketches, and sometimes the grouped hole_options. 
-            if see_groups:
-                return group_dict, reverse_sketches
-            else:
-                return reverse_sketches
+            group_dict, reverse_sketches = trees_uppper_bounds(hole_options, counts=option_counts, ids=ids)
+        # Unnumbered options still number their own expansions from this sketch's allocator. 
+        if not numbered:
+            for reverse_sketch in reverse_sketches:
+                reverse_sketch.ids = self.ids
+        return group_dict, reverse_sketches
+
+    '''
+    Take the next id for a sketch expanded from this one. 
+    @param 
+    @return sketch id. 
+    '''
+    def next_id(self) -> int:
+        global ID_COUNTER
+        if self.ids is not None:
+            return next(self.ids)
+        ID_COUNTER += 1
+        return ID_COUNTER - 1
     
+    '''
+    Sketch the trees whose substitution for a hole is in one group of options; 
+    looked up in the snapshot lattice when it was precomputed there. 
+    @param hole number, group number (in expansion order), the group's hole options, id allocator. 
+    @return list of reverse sketches. 
+    '''
+    def refine(self, hole_num: int, group_num: int, selected_group, ids):
+        if self.lattice is not None:
+            store, node_num = self.lattice
+            expansion = store.expansion(node_num, hole_num)
+            if expansion is not None:
+                return [store.sketch(child_node, ids) for child_node in expansion[1][group_num]]
+        # Trees that have the selection option in the selected hole. 
+        new_trees, new_counts = self.recover_groups(hole_num, selected_group, see_counts=True)
+        return trees_uppper_bounds(new_trees, counts=new_counts, ids=ids)[1]
+
+    '''
+    Generalize the sketch against one more tree and add the tree in place. 
+    Costs the size of the new tree unless the tree opens new holes, in which 
+    case every tree's substitution is re-keyed once for the new hole order. 
+    @param new candidate program AST, anti-unification engine, number of programs it stands for. 
+    @return 
+    '''
+    def add_tree(self, tree: ast.AST, engine=None, count: int = 1):
+        # Sketches backed by a mapped store are read-only; copy them before growing. 
+        if not isinstance(self.trees, list):
+            self.make_mutable()
+        # Compare the sketch itself (holes included) against the new tree. 
+        del_dict = compare_group([self.sketch_AST, tree], engine)
+        self.trees.append(tree)
+        self.counts.append(count)
+        # Every expansion of the sketch is stale now. 
+        EXPANSION_CACHE.invalidate(self)
+        # Only reuse the existing rows if the comparison reached every hole of the sketch. 
+        covered = {k.hole_id for k in del_dict if getattr(k, 'is_hole', False)} == set(range(1, len(self.holes) + 1))
+        # The new tree fits the sketch: only its substitution is new. 
+        if covered and all(getattr(k, 'is_hole', False) for k in del_dict):
+            for k, v in del_dict.items():
+                sub_id = self.intern_substitution(v[0])
+                self.sub_ids[k.hole_id - 1].append(sub_id)
+                if self.hole_index is not None:
+                    self.hole_index[k.hole_id - 1].setdefault(sub_id, []).append(len(self.trees) - 1)
+            return
+        # A new hole in a concrete part of the sketch lies at the same path in every 
+        # existing tree, so each tree's substitution is found by following that path. 
+        if covered and all(getattr(k, 'is_hole', False) or not any(getattr(n, 'is_hole', False) for n in ast.walk(k)) for k in del_dict):
+            paths = node_paths(self.sketch_AST)
+            sub_ids = []
+            for k, v in del_dict.items():
+                if getattr(k, 'is_hole', False):
+                    row = self.sub_ids[k.hole_id - 1]
+                else:
+                    row = array('I', (self.intern_substitution(follow_path(tree, paths[id(k)])) for tree in self.trees[:-1]))
+                row.append(self.intern_substitution(v[0]))
+                sub_ids.append(row)
+            self.sub_ids = sub_ids
+            self.sketch_AST = TreeGeneralizer(del_dict).generalize(self.sketch_AST)
+        # Otherwise (the new tree widens an existing hole): anti-unify the group again. 
+        else:
+            del_dict = compare_group(self.trees, engine)
+            self.sub_table, self.sub_lookup = [], {}
+            self.sub_ids = [array('I', map(self.intern_substitution, row)) for row in generate_substitutions(self.trees, del_dict)]
+            self.sketch_AST = TreeGeneralizer(del_dict).generalize(self.trees[0])
+        self.holes = [f"x_{i}" for i in range(len(del_dict))]
+        # The holes changed; rebuild the index on next use. 
+        self.hole_index = None
+
+    '''
+    Copy a sketch backed by a mapped store into plain in-memory containers. 
+    @param 
+    @return 
+    '''
+    def make_mutable(self):
+        # Its precomputed expansions no longer apply. 
+        self.lattice = None
+        self.trees = list(self.trees)
+        self.counts = list(self.counts)
+        self.sub_table = list(self.sub_table)
+        self.sub_lookup = dict(self.sub_lookup)
+        self.sub_ids = [array('I', row) for row in self.sub_ids]
+
     '''
     Generate a string representation of each hole option. 
     @param 
     @return A list of lists of hole option strings. 
     '''
     def generate_hole_str(self):
-        print(self.holes)
-        # List of lists of hole AST options. 
-        holes_ASTs = [self.expand_hole(hole_num) for hole_num in range(len(self.holes))]
-        # String representations of hole optinos. 
-        str_holes_ASTs = []
-        # Iterate over each list, which represents the options for a single hole. 
-        for hole_AST in holes_ASTs: 
-            str_holes_ASTs.append([ast.unparse(x.sketch_AST) for x in hole_AST])
-        return str_holes_ASTs
-
-    '''
-    Generate a JSON representation of the revere sketch.'
+        return [self.hole_option_strs(hole_num) for hole_num in range(len(self.holes))]
+
+    '''
+    Generate the string representations of a single hole's options. 
+    @param hole number. 
+    @return list of option strings. 
+    '''
+    def hole_option_strs(self, hole_num: int):
+        return [unparse(x.sketch_AST) for x in self.expand_hole(hole_num)]
+
+    '''
+    Generate a JSON representation of the revere sketch.' Hole options are 
+    not expanded here; they are served on demand by get_hole_options. 
     @param 
     @return JSON representation of the reverse sketch.
     '''
@@ -163,9 +385,9 @@ class ReverseSketch:
         # return json.dumps(self.__dict__)
         return {
             'id': self.id,
-            'sketch_str': f"{ast.unparse(self.sketch_AST)}",
-            'holes': self.holes,
-            'subs': self.generate_hole_str()
+            'sketch_str': f"{unparse(self.sketch_AST)}",
+            'holes_len': len(self.holes),
+            'count': sum(self.counts)
         }
 
     '''
@@ -174,66 +396,303 @@ class ReverseSketch:
     @return string representation of the reverse sketch.
     '''
     def __str__(self):
-        return f"{ast.unparse(self.sketch_AST)}"   
+        return f"{unparse(self.sketch_AST)}"
 
 '''
-Generate an AST with holes denoted by '?'
-@param 
+Bounded least-recently-used cache of hole expansions across sketches.
+Entries are keyed by the sketch object itself (identity) and the hole number.
+The cache is shared by all sessions; its lock only guards the bookkeeping, and
+expansions are computed outside it, once: a request for an expansion that is 
+being computed (e.g. prefetched) waits for it.
+@param maximum number of (sketch, hole) expansions kept.
+'''
+class ExpansionCache:
+    def __init__(self, maxsize: int = None):
+        self.maxsize = EXPANSION_CACHE_SIZE if maxsize is None else maxsize
+        self.lock = threading.Lock()
+        # <(sketch, hole number), (group_dict, reverse_sketches)>, least recent first.
+        self.entries = OrderedDict()
+        # <(sketch, hole number), Future> of the expansions being computed.
+        self.pending = dict()
+        self.hits = 0
+        self.misses = 0
+
+    '''
+    Look up an expansion, computing and storing it on a miss.
+    @param reverse sketch, hole number.
+    @return (group_dict, reverse_sketches); both are fresh containers.
+    '''
+    def get(self, reverse_sketch: ReverseSketch, hole_num: int):
+        key = (reverse_sketch, hole_num)
+        with self.lock:
+            entry = self.entries.get(key)
+            pending = None
+            if entry is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            elif key in self.pending:
+                # Computed by another thread; no need to compute it twice.
+                self.hits += 1
+                pending = self.pending[key]
+            else:
+                self.misses += 1
+                owned = self.pending[key] = Future()
+        if pending is not None:
+            entry = pending.result()
+        elif entry is None:
+            try:
+                # Unnumbered: prefetched expansions must not take ids from the session. 
+                entry = reverse_sketch.compute_expansion(hole_num, numbered=False)
+            except BaseException as e:
+                with self.lock:
+                    del self.pending[key]
+                owned.set_exception(e)
+                raise
+            with self.lock:
+                del self.pending[key]
+                entry = self.entries.setdefault(key, entry)
+                # Evict the least recently used expansion.
+                if len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+            owned.set_result(entry)
+        group_dict, reverse_sketches = entry
+        # Callers may extend what they get back; keep the cached containers intact.
+        return dict(group_dict), list(reverse_sketches)
+
+    '''
+    Drop every expansion of a sketch, e.g. after it gained a tree.
+    @param reverse sketch.
+    @return
+    '''
+    def invalidate(self, reverse_sketch: ReverseSketch):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] is reverse_sketch]:
+                del self.entries[key]
+
+    '''
+    Drop every expansion.
+    @param
+    @return
+    '''
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    '''
+    Cache statistics.
+    @param
+    @return <name, value>
+    '''
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'maxsize': self.maxsize}
+
+# Shared cache of hole expansions.
+EXPANSION_CACHE = ExpansionCache()
+
+# Threads prefetching hole expansions; started on first use.
+PREFETCH_POOL = None
+PREFETCH_LOCK = threading.Lock()
+
+'''
+The prefetching thread pool. Expansions are CPU bound, so a few threads only
+overlap them with the time a user spends reading a page; they share the
+process's cache, which worker processes could not.
+@param
+@return ThreadPoolExecutor, or None if prefetching is disabled.
+'''
+def prefetch_pool():
+    global PREFETCH_POOL
+    with PREFETCH_LOCK:
+        if PREFETCH_POOL is None and PREFETCH_WORKERS:
+            PREFETCH_POOL = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+    return PREFETCH_POOL
+
+'''
+Expand a hole into the cache, in the background.
+@param reverse sketch, hole number.
+@return
+'''
+def prefetch_expansion(reverse_sketch: ReverseSketch, hole_num: int):
+    try:
+        EXPANSION_CACHE.get(reverse_sketch, hole_num)
+    except Exception:
+        # The click on the hole will raise it again, in its request.
+        logger.debug("Prefetching hole %d of sketch %d failed", hole_num, reverse_sketch.id, exc_info=True)
+
+'''
+Schedule the expansion of every hole of some sketches, in order.
+@param list of reverse sketches, the most likely to be clicked first.
+@return list of futures, one per hole.
+'''
+def prefetch_expansions(reverse_sketches):
+    pool = prefetch_pool()
+    if pool is None:
+        return []
+    return [pool.submit(prefetch_expansion, reverse_sketch, hole_num)
+            for reverse_sketch in reverse_sketches[:PREFETCH_SKETCHES] for hole_num in range(len(reverse_sketch.holes))]
+
+'''
+Generate an AST with holes denoted by '?' in a single traversal. 
+Nodes that are keys of the deletion dictionary become holes; untouched 
+subtrees are shared with the input tree instead of copied, and the input 
+tree is never modified. Hole x_i is the ith key, so hole ids line up with 
+the substitution rows. 
+@param deletion dictionary <head node, rest nodes>
 @return AST with holes denoted by '?'.
 '''
-class TreeGeneralizer(ast.NodeTransformer):
+class TreeGeneralizer:
     def __init__(self, del_dict: dict[ast.AST, list[ast.AST]]) -> None:
-        self.holes = []
         self.del_dict = del_dict
-        self.counter = 0
+        # <key, hole id>. AST equality is identity, so this is a set lookup. 
+        self.hole_ids = {k: hole_id for hole_id, k in enumerate(del_dict, 1)}
 
-    def visit(self, node: ast.AST) -> Any:
-        method = 'visit_' + node.__class__.__name__
-        visitor = getattr(self, method, self.generic_visit)
-        return visitor(node)
+    def generalize(self, tree: ast.AST) -> ast.AST:
+        return self.visit(tree)
 
-    def visit_Module(self, node: ast.AST) -> Any:
-        # Cannot remove modules.
-        return super().generic_visit(node)
-    
-    def generic_visit(self, node: ast.AST) -> Any:
-        hole = ast.Name(id=f'?', ctx="")
-        hole.hole_id = self.counter + 1
-        hole.is_hole = True
-        if node.marked:
-            # Increment id for next hole. 
-            self.counter += 1
+    def visit(self, node: ast.AST) -> ast.AST:
+        hole_id = self.hole_ids.get(node)
+        if hole_id is not None:
+            hole = ast.Name(id=f'?', ctx="")
+            hole.hole_id = hole_id
+            hole.is_hole = True
+            # Cannot remove modules; the whole program is the hole. 
+            if isinstance(node, ast.Module):
+                return ast.Module(body=[ast.Expr(value=hole)], type_ignores=[])
             return hole
-        return super().generic_visit(node)
+        return rebuild_node(node, self.visit)
+
+'''
+Apply visit to the children of a node without modifying it. The node itself is 
+returned if no child changed, so untouched subtrees are shared; otherwise only 
+this node is rebuilt, keeping its location. 
+@param AST node, function from child node to new child node, fields to replace.
+@return the node or its rebuilt copy. 
+'''
+def rebuild_node(node: ast.AST, visit, **overrides) -> ast.AST:
+    changed = bool(overrides)
+    fields = {}
+    for name, value in ast.iter_fields(node):
+        if name in overrides:
+            new_value = overrides[name]
+        elif isinstance(value, ast.AST):
+            new_value = visit(value)
+        elif isinstance(value, list):
+            new_value = [visit(x) if isinstance(x, ast.AST) else x for x in value]
+            if all(a is b for a, b in zip(new_value, value)):
+                new_value = value
+        else: 
+            new_value = value
+        changed = changed or new_value is not value
+        fields[name] = new_value
+    if not changed:
+        return node
+    new_node = type(node)(**fields)
+    for attr in node._attributes:
+        if hasattr(node, attr):
+            setattr(new_node, attr, getattr(node, attr))
+    return new_node
 
 '''
-Collect all of the nodes in an AST. 
-@param AST that represents a single tree. 
-@return a list of all the nodes in the AST.
+Table that keeps its maxsize most recently used entries. Each call is a few 
+single OrderedDict operations, so threads share it without a lock: a racing 
+eviction only means the entry is computed again. 
+@param maximum number of entries kept.
 '''
-class TreeCollector(ast.NodeVisitor):
-    def __init__(self) -> None:
-        super().__init__()
-        self.nodes: list[ast.AST] = []
+class LRUTable:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    '''
+    Look up an entry, marking it as recently used. 
+    @param key. 
+    @return value, or None. 
+    '''
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            try:
+                self.entries.move_to_end(key)
+            except KeyError:
+                pass
+        return value
+
+    '''
+    Store an entry unless another thread stored one first, evicting the least recently used past maxsize. 
+    @param key, value. 
+    @return the stored value. 
+    '''
+    def setdefault(self, key, value):
+        value = self.entries.setdefault(key, value)
+        while len(self.entries) > self.maxsize:
+            try:
+                self.entries.popitem(last=False)
+            except KeyError:
+                break
+        return value
 
-    def generic_visit(self, node: ast.AST) -> None:
-        self.nodes.append(node)
-        return super().generic_visit(node)
+    def __len__(self):
+        return len(self.entries)
 
-    def collect(self, tree: ast.AST) -> list[ast.AST]: 
-        # Reset nodes. 
-        self.visit(tree)
-        return self.nodes
+# Group key of each distinct tree: <fingerprint, group key>. 
+GROUP_KEYS = LRUTable(GROUP_KEYS_SIZE)
 
 '''
-Mark every node in the tree 'False'. 
-@param root of tree to be marked. 
-@return
+Compute the group of a tree: the type of its root expression. Keys are 
+cached by fingerprint, so subsets regrouped by later expansions reuse them. 
+@param candidate program AST.
+@return group key. 
 '''
-class TreeMarker(ast.NodeVisitor):
-    def visit(self, node: ast.AST) -> ast.AST:
-        node.marked = False
-        return super().visit(node)
+def group_key(tree: ast.AST):
+    fp = fingerprint(tree)
+    key = GROUP_KEYS.get(fp)
+    if key is None:
+        key = GROUP_KEYS.setdefault(fp, compute_group_key(tree))
+    return key
+
+'''
+Compute the group of a tree from its structure, without unparsing it. 
+@param candidate program AST.
+@return group key. 
+'''
+def compute_group_key(tree: ast.AST):
+    # Parse body. 
+    if (isinstance(tree, ast.Module)):
+        if isinstance(tree.body[0], ast.FunctionDef):
+            body: ast.AST = tree.body[0]
+            logger.debug("Body: %s %s", body, body.__dict__)
+            function_name: str = body.__dict__['name']
+            expr = body
+        else:
+            body: ast.AST = tree.body[0]
+            expr = body.__dict__['value']
+            logger.debug("Expr: %s %s", body.__dict__, body.__dict__['value'])
+    else:
+        expr = tree
+
+    if (isinstance(expr, ast.Name)):
+        return f"Name-{expr.id}"
+    elif (isinstance(expr, ast.Constant)):  
+        # The repr keeps 1, 1.0 and True apart. 
+        return f"Constant-{expr.value!r}"
+    elif (isinstance(expr, ast.FunctionDef)):  
+        return f"Function-{function_name}"
+    elif (isinstance(expr, ast.BinOp)):
+        return ast.BinOp
+    elif (isinstance(expr, ast.Index)):
+        return ast.Index
+    elif (isinstance(expr, ast.Subscript)):
+        if (type(expr.slice) == ast.Slice):
+            return f"Subscript_{type(expr.slice)}"
+        else: 
+            return "Subscript_generic"
+    elif (isinstance(expr, ast.Call)):
+        if (isinstance(expr.func, ast.Attribute)):
+            return expr.func.attr
+        else: 
+            return ast.Call
+    else: 
+        return type(tree)
 
 '''
 Group trees by the type of the AST node. 
@@ -243,161 +702,663 @@ Group trees by the type of the AST node.
 def group_trees_by_type(trees: list[ast.AST]) -> list[list[ast.AST]]:
     typed_lists = {}
     for tree in trees:
-        # Parse body. 
-        if (isinstance(tree, ast.Module)):
-            if isinstance(tree.body[0], ast.FunctionDef):
-                body: ast.AST = tree.body[0]
-                print("Body: ", body, body.__dict__)
-                function_name: str = body.__dict__['name']
-                expr = body
-            else:
-                body: ast.AST = tree.body[0]
-                expr = body.__dict__['value']
-                print("Expr: ", body.__dict__, body.__dict__['value'])
-        else:
-            expr = tree
-
-        if (isinstance(expr, ast.Name)):
-            typed_lists.setdefault(f"Name-{ast.unparse(expr)}", []).append(tree) 
-        elif (isinstance(expr, ast.Constant)):  
-            typed_lists.setdefault(f"Constant-{ast.unparse(expr)}", []).append(tree) 
-        elif (isinstance(expr, ast.FunctionDef)):  
-            typed_lists.setdefault(f"Function-{function_name}", []).append(tree) 
-        elif (isinstance(expr, ast.BinOp)):
-            typed_lists.setdefault(ast.BinOp, []).append(tree) 
-        elif (isinstance(expr, ast.Index)):
-            typed_lists.setdefault(ast.Index, []).append(tree) 
-        elif (isinstance(expr, ast.Subscript)):
-            if (type(expr.slice) == ast.Slice):
-                typed_lists.setdefault(f"Subscript_{type(expr.slice)}", []).append(tree)
-            else: 
-                typed_lists.setdefault("Subscript_generic", []).append(tree)
-        elif (isinstance(expr, ast.Call)):
-            if (isinstance(expr.func, ast.Attribute)):
-                typed_lists.setdefault(expr.func.attr, []).append(tree) 
-            else: 
-                typed_lists.setdefault(ast.Call, []).append(tree) 
-        else: 
-            typed_lists.setdefault(type(tree), []).append(tree)
+        typed_lists.setdefault(group_key(tree), []).append(tree)
     return typed_lists
 
-def antiunfy(trees):
-    global ID_COUNTER
-    '''
-    Compare n ASTs
-    @param single AST
-    @paramr list of AST
-    @return <head node, rest nodes>
-    '''
-    def compare_trees(head: ast.AST, rest: list[ast.AST], del_dict: OrderedDict[ast.AST, list[ast.AST]]):
-        if not all(isinstance(t, type(head)) for t in rest):
+'''
+Digest a structural key into a fingerprint. 
+@param type tag, bytes of the fields. 
+@return a 128-bit integer. 
+'''
+def digest_key(tag: str, data: bytes) -> int:
+    digest = hashlib.blake2b(tag.encode() + b"\0", digest_size=16)
+    digest.update(data)
+    return int.from_bytes(digest.digest(), 'big')
+
+'''
+Compute the structural fingerprint of a node (Merkle-style): a digest of its 
+type and of the fingerprints of its fields, ignoring positions and ctx. The 
+fingerprint depends on the structure alone, not on what was seen before, so 
+identical nodes always share it, in every sketch, snapshot and process; 
+different structures collide with negligible (2^-128) probability. The 
+fingerprint of an AST node is cached on the node. 
+@param AST node, list of nodes, or primitive field value.
+@return an integer fingerprint. 
+'''
+def fingerprint(node) -> int:
+    if isinstance(node, ast.AST):
+        fp = getattr(node, 'fingerprint', None)
+        if fp is None:
+            # Key on the node type and the fingerprints of its fields. 
+            fields = b"".join(fingerprint(getattr(node, k, None)).to_bytes(16, 'big') for k in node._fields if k != 'ctx')
+            fp = node.fingerprint = digest_key(type(node).__name__, fields)
+        return fp
+    if isinstance(node, list):
+        return digest_key("list", b"".join(fingerprint(x).to_bytes(16, 'big') for x in node))
+    # The type keeps 1, 1.0 and True apart, and repr keeps 0.0 and -0.0 apart. 
+    return digest_key(type(node).__name__, repr(node).encode('utf-8', 'surrogatepass'))
+
+# Source text of each distinct unparsed node: <fingerprint, string>. 
+UNPARSED = LRUTable(UNPARSED_SIZE)
+
+'''
+Memoized ast.unparse. Structurally identical nodes share one entry, so each 
+distinct sketch, substitution or program is unparsed once. Nodes are never 
+modified in place (generalization rebuilds them), so entries never go stale. 
+@param AST node. 
+@return source string. 
+'''
+def unparse(node: ast.AST) -> str:
+    fp = fingerprint(node)
+    source = UNPARSED.get(fp)
+    if source is None:
+        source = UNPARSED.setdefault(fp, ast.unparse(node))
+    return source
+
+'''
+Flatten a tree into parallel arrays indexed by slot. Slot 0 is the shared 
+None slot, which also stands in for missing list elements. 
+@param single AST
+@return (objects, kinds, fingerprints, labels, children) arrays. 
+'''
+def flatten_tree(tree: ast.AST):
+    objs, kinds, fps, labels, kids = [None], [type(None)], [None], [None], [()]
+
+    def visit(value) -> int:
+        if value is None:
+            return 0
+        slot = len(objs)
+        objs.append(value)
+        kinds.append(type(value))
+        fps.append(None)
+        labels.append(None)
+        kids.append(())
+        if isinstance(value, ast.AST):
+            fps[slot] = fingerprint(value)
+            # The value each node type is compared on before recursing. 
+            if isinstance(value, ast.Name):
+                labels[slot] = value.id
+            elif isinstance(value, ast.Constant):
+                labels[slot] = value.value
+            elif isinstance(value, ast.Subscript):
+                labels[slot] = type(value.slice)
+            kids[slot] = tuple(visit(getattr(value, k, None)) for k in value._fields if k not in IGNORED_FIELDS)
+        elif isinstance(value, list):
+            kids[slot] = tuple(visit(x) for x in value)
+        return slot
+
+    visit(tree)
+    return objs, kinds, fps, labels, kids
+
+'''
+Compare n ASTs column-wise: every step handles one node position across all 
+trees at once, reading types, ids and constant values from flat arrays. 
+Produces the same deletion dictionary as antiunfy's compare_trees. 
+@param list of AST
+@return <head node, rest nodes>
+'''
+def compare_columns(trees: list[ast.AST]) -> dict:
+    del_dict = {}
+    objs, kinds, fps, labels, kids = zip(*map(flatten_tree, trees))
+    others = range(1, len(trees))
+
+    # bare_mismatch, on a column. 
+    def bare_column(column) -> bool:
+        head_kind = kinds[0][column[0]]
+        if head_kind is list and all(kinds[t][column[t]] is list for t in others):
+            return any(bare_column(list(items)) for items in zip_longest(*(kids[t][column[t]] for t in range(len(trees))), fillvalue=0))
+        if all(issubclass(kinds[t][column[t]], head_kind) for t in others):
+            return not issubclass(head_kind, ast.AST) and any(objs[t][column[t]] != objs[0][column[0]] for t in others)
+        return not issubclass(head_kind, ast.AST) or not all(issubclass(kinds[t][column[t]], ast.AST) for t in others)
+
+    # Each column holds one slot per tree; the root is slot 1. 
+    stack = [[1] * len(trees)]
+    while stack:
+        column = stack.pop()
+        head = column[0]
+        head_kind = kinds[0][head]
+        # Type mismatch: the whole position becomes a hole. 
+        if not all(kinds[t][column[t]] is head_kind or issubclass(kinds[t][column[t]], head_kind) for t in others):
+            del_dict[objs[0][head]] = [objs[t][column[t]] for t in others]
+            continue
+
+        if issubclass(head_kind, ast.AST):
+            # Identical subtrees cannot open a hole. 
+            head_fp = fps[0][head]
+            if all(fps[t][column[t]] == head_fp for t in others):
+                continue
+
+            head_label = labels[0][head]
+            if head_kind is ast.Name or head_kind is ast.Constant: 
+                if any(labels[t][column[t]] != head_label for t in others):
+                    del_dict[objs[0][head]] = [objs[t][column[t]] for t in others]
+                    continue
+            elif head_kind is ast.Subscript: 
+                if head_label == ast.Slice and any(labels[t][column[t]] != ast.Slice for t in others):
+                    del_dict[objs[0][head]] = [objs[t][column[t]] for t in others]
+                    continue
+
+            # One new column per field, pushed in reverse to visit them in order. 
+            rows = [kids[t][column[t]] for t in range(len(trees))]
+            fields = [list(field) for field in zip(*rows)]
+            if any(bare_column(field) for field in fields):
+                del_dict[objs[0][head]] = [objs[t][column[t]] for t in others]
+                continue
+            stack.extend(reversed(fields))
+        elif head_kind is list:
+            rows = [kids[t][column[t]] for t in range(len(trees))]
+            stack.extend(list(field) for field in reversed(list(zip_longest(*rows, fillvalue=0))))
+    return del_dict
+
+'''
+Whether values at the same position differ in a way only their parent node 
+can be a hole for: they differ and some of them are not nodes (None or a 
+primitive, such as an attribute name), or they are lists whose items do. 
+@param head value, rest values. 
+@return bool 
+'''
+def bare_mismatch(head, rest) -> bool:
+    if isinstance(head, list) and all(isinstance(t, list) for t in rest):
+        return any(bare_mismatch(items[0], list(items[1:])) for items in zip_longest(head, *rest))
+    if all(isinstance(t, type(head)) for t in rest):
+        return not isinstance(head, ast.AST) and any(t != head for t in rest)
+    return not isinstance(head, ast.AST) or not all(isinstance(t, ast.AST) for t in rest)
+
+'''
+Compare n ASTs
+@param single AST
+@paramr list of AST
+@return <head node, rest nodes>
+'''
+def compare_trees(head: ast.AST, rest: list[ast.AST], del_dict: OrderedDict[ast.AST, list[ast.AST]]):
+    if not all(isinstance(t, type(head)) for t in rest):
+        del_dict[head] = rest
+        return del_dict
+
+    if isinstance(head, ast.AST):
+        # Identical subtrees cannot open a hole; skip them in O(1). 
+        head_fp = fingerprint(head)
+        if all(fingerprint(t) == head_fp for t in rest):
+            return del_dict
+
+        if (isinstance(head, ast.Name) and any(isinstance(t, ast.Name) and (t.id != head.id) for t in rest)):
             del_dict[head] = rest
             return del_dict
 
-        if isinstance(head, ast.AST):
-            if (isinstance(head, ast.Name) and any(isinstance(t, ast.Name) and (t.id != head.id) for t in rest)):
-                del_dict[head] = rest
-                return del_dict
+        if (isinstance(head, ast.Constant) and any(isinstance(t, ast.Constant) and (t.value != head.value) for t in rest)):
+            del_dict[head] = rest
+            return del_dict
 
-            if (isinstance(head, ast.Constant) and any(isinstance(t, ast.Constant) and (t.value != head.value) for t in rest)):
+        if (isinstance(head, ast.Subscript) and (isinstance(t, ast.Subscript) for t in rest)):
+            if type(head.__dict__['slice']) == ast.Slice and any(type(t.__dict__['slice']) != ast.Slice for t in rest):
                 del_dict[head] = rest
                 return del_dict
 
-            if (isinstance(head, ast.Subscript) and (isinstance(t, ast.Subscript) for t in rest)):
-                if type(head.__dict__['slice']) == ast.Slice and any(type(t.__dict__['slice']) != ast.Slice for t in rest):
-                    del_dict[head] = rest
-                    return del_dict
+        # A field that differs without a node on every side (a missing slice step or 
+        # list item, a primitive) cannot be a hole of its own; the node is the hole. 
+        if any(bare_mismatch(getattr(head, k, None), [getattr(t, k, None) for t in rest]) for k in head._fields if k not in IGNORED_FIELDS):
+            del_dict[head] = rest
+            return del_dict
+
+        for k,v in vars(head).items():
+            if k in IGNORED_FIELDS:
+                    continue
+            compare_trees(v, list(map(lambda t: getattr(t, k), rest)), del_dict)
 
-            for k,v in vars(head).items():
-                if k in {"lineno", "end_lineno", "col_offset", "end_col_offset", "ctx", "marked"}:
-                        continue
-                # print("Here: ", v, head)
-                compare_trees(v, list(map(lambda t: getattr(t, k), rest)), del_dict)
+    if isinstance(head, list) and all(isinstance(t, list) for t in rest):
+        for tups in zip_longest(head, *rest):
+            compare_trees(tups[0], list(tups[1:]), del_dict)
 
-        if isinstance(head, list) and all(isinstance(t, list) for t in rest):
-            for tups in zip_longest(head, *rest):
-                compare_trees(tups[0], list(tups[1:]), del_dict)
+    # Return statement. 
+    logger.debug("Del dictionary: %s", del_dict)
+    return del_dict
 
-        # Return statement. 
-        print("Del dictionary: ", del_dict)
-        return del_dict
+'''
+Compute the deletion dictionary of a group with the selected engine. 
+@param list of AST
+@return <head node, rest nodes>
+'''
+def compare_group(trees: list[ast.AST], engine=None) -> dict:
+    if (engine or ANTIUNIFY_ENGINE) == "columnar":
+        return compare_columns(trees)
+    return compare_trees(trees[0], trees[1:], {})
 
-    '''
-    Generate substitutions for each AST. 
-    @param list of ASTs
-    @return <x1:?,..., xn:?>
-    '''
-    def generate_substitutions(del_dict: OrderedDict[ast.AST, list[ast.AST]]):
-        # A list of substitutions for each tree.
-        substitutions = []
-        # Generate substitution for each tree.
-        for tree_id, tree in enumerate(trees): 
-            substitution = {}
-            # Assign the current tree's ith hole to x_i. 
-            for hole_id, k in enumerate(del_dict):
-                # If the current tree is the first tree, the ith hole is the current key.
-                if tree_id == 0: 
-                    substitution[f"x_{hole_id}"] = k
-                # Otherwise, it's the i-1 element of the current key.
-                else:
-                    substitution[f"x_{hole_id}"] = del_dict[k][tree_id-1]
-            substitutions.append(substitution)
-        return substitutions
+'''
+Generate substitutions for each AST. 
+@param list of ASTs, deletion dictionary of the list
+@return one row per hole x_i: the substitution of every tree for x_i. 
+'''
+def generate_substitutions(trees: list[ast.AST], del_dict: OrderedDict[ast.AST, list[ast.AST]]):
+    # The first tree's ith hole is the ith key; the others are the key's values, in tree order. 
+    return [[k] + v for k, v in del_dict.items()]
 
-    '''
-    Mark the nodes to be deleted. 
-    @param AST that represents a single tree.
-    @return 
-    '''
-    def mark_nodes(tree: ast.AST, del_dict: OrderedDict[ast.AST, list[ast.AST]]):
-        # Mark every node as 'False'.
-        TreeMarker().visit(tree)
-        nodes = TreeCollector().collect(tree)
-        for node in del_dict: 
-            # The index of a node to be deleted. 
-            idx = nodes.index(node)
-            # Mark the node 'True'. 
-            nodes[idx].marked = True
-        
-    '''
-    Generates generalization of n trees. 
-    @param list of ASTs
-    @return generalization of n trees. 
-    '''
-    def generate_generalizations(del_dict: OrderedDict[ast.AST, list[ast.AST]]): 
-        # Mark the nodes that are going to be deleted in the head node.
-        mark_nodes(trees[0], del_dict)
-        # Generate a copy of the tree to the generalized. 
-        generalized_tree = copy.deepcopy(trees[0])
-        # Generate a generalization of the tree.  
-        TreeGeneralizer(del_dict).visit(generalized_tree)
-        # Return generalization.
-        return generalized_tree
-
-    #  Generate hole options.
-    del_dict = compare_trees(trees[0], trees[1:], {})
+def antiunfy(trees, engine=None, del_dict=None, counts=None, ids=None):
+    global ID_COUNTER
+    #  Generate hole options, unless they were computed elsewhere (e.g. by a worker process).
+    if del_dict is None:
+        del_dict = compare_group(trees, engine)
     #  Generate holes.
     holes = [f"x_{i}" for i in range(len(del_dict))]
-    #  Generate reverse sketch of group of trees. 
-    reverse_sketch = generate_generalizations(del_dict)
+    #  Generate reverse sketch of group of trees, sharing the head's untouched subtrees. 
+    reverse_sketch = TreeGeneralizer(del_dict).generalize(trees[0])
     #  Genera substitutions for each tree in the group. 
-    substitutions = generate_substitutions(del_dict)
+    substitutions = generate_substitutions(trees, del_dict)
     # (reverse sketch AST, substitutions for each tree)
-    reverse_sketch_obj = ReverseSketch(ID_COUNTER, reverse_sketch, trees, holes, substitutions)
+    # Take the next id from the given allocator, or from the module counter. 
+    if ids is not None:
+        return ReverseSketch(next(ids), reverse_sketch, trees, holes, substitutions, counts, ids)
+    reverse_sketch_obj = ReverseSketch(ID_COUNTER, reverse_sketch, trees, holes, substitutions, counts)
     # Update the id counter. 
     ID_COUNTER += 1
     return reverse_sketch_obj
 
+'''
+Serialize a tree into compact nested tuples: (node type, field values...), 
+without positions or ctx. Much smaller to ship to a worker than a pickled AST. 
+@param AST, list of ASTs or primitive field value.
+@return serialized tree. 
+'''
+def serialize_tree(node):
+    if isinstance(node, ast.AST):
+        return (type(node).__name__,) + tuple(serialize_tree(getattr(node, k, None)) for k in node._fields if k != 'ctx')
+    if isinstance(node, list):
+        return [serialize_tree(x) for x in node]
+    return node
+
+'''
+Rebuild a tree from its serialized form. 
+@param serialized tree.
+@return AST. 
+'''
+def deserialize_tree(data):
+    if isinstance(data, tuple):
+        node_type = getattr(ast, data[0])
+        fields = [k for k in node_type._fields if k != 'ctx']
+        return node_type(**dict(zip(fields, map(deserialize_tree, data[1:]))))
+    if isinstance(data, list):
+        return [deserialize_tree(x) for x in data]
+    return data
+
+'''
+List the AST nodes of a tree in serialization order, so that a node's index 
+is the same in the original tree and in its deserialized copy. 
+@param AST
+@return list of AST nodes. 
+'''
+def preorder_nodes(tree: ast.AST) -> list[ast.AST]:
+    nodes = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, ast.AST):
+            nodes.append(node)
+            stack.extend(reversed([getattr(node, k, None) for k in node._fields if k != 'ctx']))
+        elif isinstance(node, list):
+            stack.extend(reversed(node))
+    return nodes
+
+'''
+Worker entry point: compare a serialized group. Nodes are returned as their 
+preorder index in their tree; primitive keys are returned wrapped in a 1-tuple. 
+@param list of serialized trees, engine name.
+@return list of (head reference, rest references). 
+'''
+def compare_serialized_group(serialized_trees, engine):
+    trees = [deserialize_tree(t) for t in serialized_trees]
+    del_dict = compare_group(trees, engine)
+    indices = [{id(node): idx for idx, node in enumerate(preorder_nodes(tree))} for tree in trees]
+
+    def ref(tree_id, value):
+        return indices[tree_id][id(value)] if isinstance(value, ast.AST) else (value,)
+
+    return [(ref(0, k), [ref(tree_id, x) for tree_id, x in enumerate(v, 1)]) for k, v in del_dict.items()]
+
+'''
+Map a worker's references back onto the original trees of the group. 
+@param list of ASTs, list of (head reference, rest references).
+@return <head node, rest nodes>
+'''
+def resolve_del_dict(trees: list[ast.AST], refs) -> dict:
+    nodes = [preorder_nodes(tree) for tree in trees] if refs else []
+
+    def resolve(tree_id, r):
+        return r[0] if isinstance(r, tuple) else nodes[tree_id][r]
+
+    return {resolve(0, k): [resolve(tree_id, x) for tree_id, x in enumerate(v, 1)] for k, v in refs}
+
+'''
+Anti-unify independent groups across a process pool. Results are gathered in 
+group order, so sketch IDs are the same as in a sequential run. 
+@param list of groups of ASTs, engine name, number of worker processes, counts per group.
+@return list of reverse sketches, one per group. 
+'''
+def antiunfy_parallel(groups: list[list[ast.AST]], engine=None, workers=None, group_counts=None, ids=None, progress=None):
+    engine = engine or ANTIUNIFY_ENGINE
+    # Single-tree groups have nothing to compare; don't ship them. 
+    shipped = [group for group in groups if len(group) > 1]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        payloads = [[serialize_tree(tree) for tree in group] for group in shipped]
+        chunksize = max(1, len(payloads) // (4 * (workers or os.cpu_count() or 1)))
+        results = iter(executor.map(compare_serialized_group, payloads, repeat(engine), chunksize=chunksize))
+        reverse_sketches = []
+        for group_id, group in enumerate(groups):
+            del_dict = resolve_del_dict(group, next(results)) if len(group) > 1 else {}
+            reverse_sketches.append(antiunfy(group, engine, del_dict, group_counts[group_id] if group_counts else None, ids))
+            if progress:
+                progress(len(reverse_sketches), len(groups))
+    return reverse_sketches
+
+'''
+Record the path (field name, list index) from the root to every node. 
+@param AST
+@return <id(node), path>
+'''
+def node_paths(tree: ast.AST) -> dict:
+    paths = {}
+    stack = [(tree, ())]
+    while stack:
+        node, path = stack.pop()
+        paths[id(node)] = path
+        for k, v in ast.iter_fields(node):
+            if isinstance(v, ast.AST):
+                stack.append((v, path + ((k, None),)))
+            elif isinstance(v, list):
+                stack.extend((x, path + ((k, i),)) for i, x in enumerate(v) if isinstance(x, ast.AST))
+    return paths
+
+'''
+Follow a path recorded by node_paths in another tree of the same shape. 
+@param AST, path
+@return the node at that path. 
+'''
+def follow_path(tree: ast.AST, path):
+    node = tree
+    for k, i in path:
+        node = getattr(node, k) if i is None else getattr(node, k)[i]
+    return node
+
+'''
+A set of reverse sketches that grows one candidate program at a time, 
+for candidates that arrive as a stream instead of a complete batch. 
+@param initial candidate program ASTs, anti-unification engine. 
+'''
+class SketchSet:
+    def __init__(self, trees=(), engine=None):
+        self.engine = engine
+        # <group key, list of trees>, as returned by group_trees_by_type. 
+        self.groups = {}
+        # <group key, reverse sketch of the group>
+        self.reverse_sketches = {}
+        # <fingerprint, (reverse sketch, tree index)> of every distinct tree. 
+        self.positions = {}
+        for tree in trees:
+            self.add_tree(tree)
+
+    '''
+    Route a tree to its group and generalize that group's sketch against it. 
+    @param candidate program AST. 
+    @return the reverse sketch that now covers the tree. 
+    '''
+    def add_tree(self, tree: ast.AST) -> "ReverseSketch":
+        # A duplicate only bumps the count of its representative. 
+        fp = fingerprint(tree)
+        if fp in self.positions:
+            reverse_sketch, tree_id = self.positions[fp]
+            reverse_sketch.counts[tree_id] += 1
+            EXPANSION_CACHE.invalidate(reverse_sketch)
+            return reverse_sketch
+        key = group_key(tree)
+        reverse_sketch = self.reverse_sketches.get(key)
+        if reverse_sketch is None:
+            reverse_sketch = antiunfy([tree], self.engine)
+            self.reverse_sketches[key] = reverse_sketch
+            # The group shares the sketch's tree list. 
+            self.groups[key] = reverse_sketch.trees
+        else:
+            reverse_sketch.add_tree(tree, self.engine)
+        self.positions[fp] = (reverse_sketch, len(reverse_sketch.trees) - 1)
+        return reverse_sketch
+
+    def extend(self, trees):
+        for tree in trees:
+            self.add_tree(tree)
+
+    '''
+    The same result as trees_uppper_bounds over every tree added so far. 
+    @param 
+    @return (grouped dictionary, reverse sketches)
+    '''
+    def upper_bounds(self):
+        return self.groups, list(self.reverse_sketches.values())
+
+# Nodes that open a scope of their own. 
+SCOPE_NODES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef, ast.ListComp, ast.SetComp, ast.GeneratorExp, ast.DictComp)
+
+'''
+A scope of a candidate program: the names bound in it, and whether each 
+may be renamed (function, class and import names, and class attributes, are kept). 
+@param scope node (the tree for the module scope), enclosing scope. 
+'''
+class BindingScope:
+    def __init__(self, node: ast.AST, parent=None):
+        self.node = node
+        self.parent = parent
+        # <name, renamable>
+        self.names = {}
+        self.globals = set()
+        self.nonlocals = set()
+
+    '''
+    Bind a name in this scope, or where a global/nonlocal declaration sends it. 
+    @param name, whether it may be renamed. 
+    @return 
+    '''
+    def bind(self, name: str, renamable: bool = True):
+        if name in self.globals or name in self.nonlocals:
+            return
+        self.names[name] = self.names.get(name, True) and renamable and not isinstance(self.node, ast.ClassDef)
+
+    '''
+    Find the scope whose binding a use of a name in this scope refers to. 
+    Class scopes are not visible from the scopes nested in them. 
+    @param name. 
+    @return scope, or None if the name is free. 
+    '''
+    def resolve(self, name: str):
+        scope = self
+        while scope is not None:
+            if scope is self or not isinstance(scope.node, ast.ClassDef):
+                if name in scope.globals:
+                    while scope.parent is not None:
+                        scope = scope.parent
+                    return scope if name in scope.names else None
+                if name in scope.names and name not in scope.nonlocals:
+                    return scope
+            scope = scope.parent
+        return None
+
+'''
+Find the scope of every identifier of a tree. 
+@param candidate program AST. 
+@return <id of a Name, arg, ExceptHandler, Global or Nonlocal node, scope its identifiers are resolved in>
+'''
+def identifier_scopes(tree: ast.AST) -> dict:
+    scopes = {}
+
+    def visit_all(nodes, scope):
+        for node in nodes:
+            if isinstance(node, ast.AST):
+                visit(node, scope)
+
+    def visit(node, scope):
+        if isinstance(node, ast.Name):
+            scopes[id(node)] = scope
+            if isinstance(node.ctx, (ast.Store, ast.Del)):
+                scope.bind(node.id)
+        elif isinstance(node, ast.NamedExpr):
+            # The target binds outside of comprehensions. 
+            target_scope = scope
+            while isinstance(target_scope.node, (ast.ListComp, ast.SetComp, ast.GeneratorExp, ast.DictComp)):
+                target_scope = target_scope.parent
+            visit(node.target, target_scope)
+            visit(node.value, scope)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            scopes[id(node)] = scope
+            (scope.globals if isinstance(node, ast.Global) else scope.nonlocals).update(node.names)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                if alias.name != '*':
+                    scope.bind(alias.asname or alias.name.split('.')[0], renamable=False)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+            # Decorators, defaults and annotations are evaluated in the enclosing scope. 
+            args = node.args
+            visit_all(getattr(node, 'decorator_list', []) + args.defaults + args.kw_defaults, scope)
+            all_args = args.posonlyargs + args.args + [args.vararg] + args.kwonlyargs + [args.kwarg]
+            visit_all([arg.annotation for arg in all_args if arg is not None] + [getattr(node, 'returns', None)], scope)
+            if not isinstance(node, ast.Lambda):
+                scope.bind(node.name, renamable=False)
+            inner = BindingScope(node, scope)
+            for arg in all_args:
+                if arg is not None:
+                    scopes[id(arg)] = inner
+                    inner.bind(arg.arg)
+            visit_all(node.body if isinstance(node.body, list) else [node.body], inner)
+        elif isinstance(node, ast.ClassDef):
+            visit_all(node.decorator_list + node.bases + node.keywords, scope)
+            scope.bind(node.name, renamable=False)
+            visit_all(node.body, BindingScope(node, scope))
+        elif isinstance(node, (ast.ListComp, ast.SetComp, ast.GeneratorExp, ast.DictComp)):
+            # The first iterable is evaluated in the enclosing scope. 
+            visit(node.generators[0].iter, scope)
+            inner = BindingScope(node, scope)
+            for generator_num, generator in enumerate(node.generators):
+                visit(generator.target, inner)
+                if generator_num:
+                    visit(generator.iter, inner)
+                visit_all(generator.ifs, inner)
+            visit_all([node.key, node.value] if isinstance(node, ast.DictComp) else [node.elt], inner)
+        else:
+            if isinstance(node, ast.ExceptHandler) and node.name:
+                scopes[id(node)] = scope
+                scope.bind(node.name)
+            for child in ast.iter_child_nodes(node):
+                visit(child, scope)
+
+    visit(tree, BindingScope(tree))
+    return scopes
+
+'''
+Canonicalize a tree up to consistent renaming of its bound identifiers 
+(arguments, assignment/loop/comprehension targets, exception names): each 
+binding is renamed to a positional placeholder _0, _1, ... in order of first 
+occurrence, and so is every use that resolves to it through the scopes of 
+the tree (functions, lambdas, classes, comprehensions). Free names, and 
+function, class and import names, are kept. The canonical tree keeps the 
+original tree for display, so it lives as long as the dataset that holds it. 
+@param candidate program AST. 
+@return canonical AST; the tree itself if it binds nothing. 
+'''
+def alpha_canonicalize(tree: ast.AST) -> ast.AST:
+    scopes = identifier_scopes(tree)
+
+    def identifiers(node):
+        if isinstance(node, (ast.Global, ast.Nonlocal)):
+            return node.names
+        return [getattr(node, {ast.Name: 'id', ast.arg: 'arg'}.get(type(node), 'name'))]
+
+    # Bindings that are renamed, and the names that are kept; placeholders skip the latter. 
+    renamed = set()
+    kept = set()
+    for node in preorder_nodes(tree):
+        scope = scopes.get(id(node))
+        if scope is None:
+            continue
+        for name in identifiers(node):
+            binding = scope.resolve(name)
+            if binding is not None and binding.names[name]:
+                renamed.add((binding, name))
+            else:
+                kept.add(name)
+    if not renamed:
+        return tree
+    placeholders = (f"_{i}" for i in count() if f"_{i}" not in kept)
+    mapping = {}
+
+    def rename(node, name):
+        binding = scopes[id(node)].resolve(name)
+        if (binding, name) not in renamed:
+            return name
+        if (binding, name) not in mapping:
+            mapping[binding, name] = next(placeholders)
+        return mapping[binding, name]
+
+    def visit(node):
+        if id(node) not in scopes:
+            return rebuild_node(node, visit)
+        if isinstance(node, (ast.Global, ast.Nonlocal)):
+            names = [rename(node, name) for name in node.names]
+            return node if names == node.names else rebuild_node(node, visit, names=names)
+        field = {ast.Name: 'id', ast.arg: 'arg'}.get(type(node), 'name')
+        name = getattr(node, field)
+        new_name = rename(node, name)
+        return rebuild_node(node, visit) if new_name == name else rebuild_node(node, visit, **{field: new_name})
+
+    canonical = visit(tree)
+    # Not a field: fingerprints and comparisons ignore it. 
+    canonical.original = tree
+    return canonical
+
+'''
+Unparse a candidate program as it was written, undoing alpha-renaming. 
+@param candidate program AST. 
+@return program string. 
+'''
+def unparse_program(tree: ast.AST) -> str:
+    return unparse(getattr(tree, 'original', tree))
+
+'''
+Collapse structurally identical trees into one representative with a count. 
+@param list of ASTs, optional number of programs each tree already stands for.
+@return (representative trees in first-seen order, counts)
+'''
+def dedup_trees(trees, counts=None):
+    positions = {}
+    unique_trees = []
+    unique_counts = []
+    for tree_id, tree in enumerate(trees):
+        fp = fingerprint(tree)
+        count = counts[tree_id] if counts is not None else 1
+        position = positions.get(fp)
+        if position is None:
+            positions[fp] = len(unique_trees)
+            unique_trees.append(tree)
+            unique_counts.append(count)
+        else:
+            unique_counts[position] += count
+    return unique_trees, unique_counts
+
 '''
 Anti-unify n trees. 
 @param list of candidate program ASTS.
 @return the most specific generalization of n trees. 
 '''
-def trees_uppper_bounds(trees: list[ast.AST]):
+def trees_uppper_bounds(trees: list[ast.AST], engine=None, workers=None, counts=None, ids=None, progress=None):
+    # Sketch distinct programs only; duplicates become counts. 
+    trees, counts = dedup_trees(trees, counts)
+    count_of = {id(tree): count for tree, count in zip(trees, counts)}
     # Group trees by root node type. 
     grouped_dict = group_trees_by_type(trees)
-    # Anti-unify each group. 
-    return grouped_dict, [antiunfy(group_items) for group, group_items in grouped_dict.items()]
+    group_counts = [[count_of[id(tree)] for tree in group_items] for group_items in grouped_dict.values()]
+    # Anti-unify the groups across processes if asked to; they are independent. 
+    if workers and workers > 1 and len(grouped_dict) > 1:
+        return grouped_dict, antiunfy_parallel(list(grouped_dict.values()), engine, workers, group_counts, ids, progress)
+    # Anti-unify each group, reporting (groups done, groups) after each one. 
+    reverse_sketches = []
+    for group_items, item_counts in zip(grouped_dict.values(), group_counts):
+        reverse_sketches.append(antiunfy(group_items, engine, counts=item_counts, ids=ids))
+        if progress:
+            progress(len(reverse_sketches), len(grouped_dict))
+    return grouped_dict, reverse_sketches
 
 '''
 Expand a single hole.  
@@ -407,18 +1368,87 @@ Expand a single hole.
 def expand_hole(reverse_sketch_obj: ReverseSketch, hole_id):
     if reverse_sketch_obj.holes:
         # Reverse ksetches that can fill the selected hole. 
-        hole_options = list(map(lambda x: ast.unparse(x.sketch_AST), reverse_sketch_obj.expand_hole(hole_id)))
-        # print("Options: ", hole_options)
         return reverse_sketch_obj.expand_hole(hole_id)
 
+'''
+Parse a chunk of candidate lines. Runs in worker processes. 
+@param list of (line number, source line). 
+@return (parsed ASTs, list of (line number, syntax error message)). 
+'''
+def parse_chunk(numbered_lines):
+    trees = []
+    errors = []
+    for line_no, line in numbered_lines:
+        try:
+            trees.append(ast.parse(line))
+        except SyntaxError as e:
+            errors.append((line_no, e.msg))
+    return trees, errors
+
+'''
+Group the non-blank lines of a file into chunks, reading it lazily. 
+@param file name, lines per chunk, the lines themselves if they are not read from the file. 
+@return generator of lists of (line number, stripped line). 
+'''
+def iter_line_chunks(file_name, chunk_size: int, lines=None):
+    if lines is None:
+        with open(file_name) as f:
+            yield from iter_line_chunks(file_name, chunk_size, f)
+        return
+    chunk = []
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if line:
+            chunk.append((line_no, line))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+'''
+Parse Python programs from a file, one per line, chunk by chunk. The file is 
+streamed; with workers, chunks are parsed in a process pool with a bounded 
+number in flight, and still come out in file order. Lines that don't parse are 
+reported and skipped. Chunks can feed grouping as they arrive, e.g. SketchSet.extend. 
+Lines already in memory (e.g. uploaded) can be given instead; the file name then only names them. 
+@param file name, lines per chunk, worker processes (None parses in-process), lines.
+@return generator of lists of ASTs. 
+'''
+def iter_trees(file_name, chunk_size: int = None, workers: int = None, lines=None):
+    chunks = iter_line_chunks(file_name, chunk_size or PARSE_CHUNK_SIZE, lines)
+    workers = PARSE_WORKERS if workers is None else workers
+    if not workers or workers < 2:
+        results = map(parse_chunk, chunks)
+    else:
+        results = parse_chunks_parallel(chunks, workers)
+    for trees, errors in results:
+        for line_no, message in errors:
+            logger.warning("Skipping line %d of %s: %s", line_no, file_name, message)
+        yield trees
+
+'''
+Parse chunks in a process pool, keeping at most two chunks per worker in flight. 
+@param iterable of chunks, worker processes. 
+@return generator of parse_chunk results, in chunk order. 
+'''
+def parse_chunks_parallel(chunks, workers: int):
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(parse_chunk, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
 '''
 Read Python programs from a file. 
 @param 
 @return the most specific generalization of n trees. 
 '''
 def read_trees(file_name) -> list[ast.AST]:
-    with open(file_name) as f:
-        return [ast.parse(line.strip()) for line in f.readlines()]
+    return [tree for trees in iter_trees(file_name) for tree in trees]
 
 '''
 Read Python programs from a file. 
@@ -437,23 +1467,1011 @@ def read_multi_line_trees():
     print("Unparsed: ", unparsed)
     return trees 
 
+'''
+Binary layout of the sketch store. Everything after the header is native
+32-bit words, so a mapped file is read in place through a memoryview:
+    header | words | string offsets | string bytes
+Each value is one tagged word (tag in the low 4 bits, payload above),
+followed by its contents: a node by its fields in _fields order, a list by
+its items, a float or complex by its raw IEEE doubles.
+The sketches are the nodes of the refinement lattice; the root sketches come
+first. A sketch record is
+    sketch AST | first tree | trees | holes | substitutions | group key |
+    expansion table | substitution offsets | holes x trees substitution ids
+and its expansion table (0 if it was not expanded) has one entry per hole,
+0 if that hole was not expanded, or
+    options | option nodes | per option: children | child nodes
+'''
+STORE_MAGIC = b"OVSK"
+STORE_VERSION = 4
+# magic, version, Python major and minor version (node layouts differ between
+# versions), sha256 of the candidates file, words, strings, string bytes,
+# trees, root sketches, lattice nodes, index offset.
+STORE_HEADER = struct.Struct("<4sIII32sIIIIIII")
+(TAG_NONE, TAG_NODE, TAG_LIST, TAG_STR, TAG_INT, TAG_FLOAT, TAG_COMPLEX,
+ TAG_BOOL, TAG_BYTES, TAG_ELLIPSIS, TAG_HOLE) = range(11)
+DOUBLE = struct.Struct("=d")
+
+'''
+Encoder of trees into the words and string table of a sketch store.
+@param
+'''
+class StoreWriter:
+    def __init__(self):
+        self.words = array('I')
+        # <string, index in the string table>.
+        self.strings = {}
+        # <fingerprint, offset> of the trees encoded so far; lattice nodes share their trees.
+        self.tree_offsets = {}
+
+    '''
+    Index of a string in the string table, adding it on first use.
+    @param string.
+    @return index.
+    '''
+    def string(self, value: str) -> int:
+        index = self.strings.get(value)
+        if index is None:
+            index = self.strings[value] = len(self.strings)
+        return index
+
+    '''
+    Append a tagged word.
+    @param tag, payload.
+    @return
+    '''
+    def tag(self, tag: int, payload: int = 0):
+        self.words.append(payload << 4 | tag)
+
+    '''
+    Encode a tree, or any field value, at the end of the words.
+    @param AST, list of ASTs or primitive field value.
+    @return offset of the encoding in the words.
+    '''
+    def encode(self, value) -> int:
+        offset = len(self.words)
+        stack = [value]
+        while stack:
+            value = stack.pop()
+            if getattr(value, 'is_hole', False):
+                self.tag(TAG_HOLE, value.hole_id)
+            elif isinstance(value, ast.AST):
+                self.tag(TAG_NODE, self.string(type(value).__name__))
+                stack.extend(reversed([getattr(value, k, None) for k in value._fields]))
+            elif isinstance(value, list):
+                self.tag(TAG_LIST, len(value))
+                stack.extend(reversed(value))
+            elif value is None:
+                self.tag(TAG_NONE)
+            elif value is Ellipsis:
+                self.tag(TAG_ELLIPSIS)
+            elif isinstance(value, bool):
+                self.tag(TAG_BOOL, int(value))
+            elif isinstance(value, int):
+                self.tag(TAG_INT, self.string(str(value)))
+            elif isinstance(value, str):
+                self.tag(TAG_STR, self.string(value))
+            elif isinstance(value, bytes):
+                self.tag(TAG_BYTES, self.string(value.decode('latin-1')))
+            elif isinstance(value, float):
+                self.tag(TAG_FLOAT)
+                self.words.frombytes(DOUBLE.pack(value))
+            elif isinstance(value, complex):
+                self.tag(TAG_COMPLEX)
+                self.words.frombytes(DOUBLE.pack(value.real) + DOUBLE.pack(value.imag))
+            else:
+                raise TypeError(f"Cannot store {type(value).__name__} values")
+        return offset
+
+    '''
+    Encode a concrete tree once, however many sketches refer to it.
+    @param AST without holes.
+    @return offset of its encoding in the words.
+    '''
+    def encode_tree(self, tree: ast.AST) -> int:
+        fp = fingerprint(tree)
+        offset = self.tree_offsets.get(fp)
+        if offset is None:
+            offset = self.tree_offsets[fp] = self.encode(tree)
+        return offset
+
+    '''
+    Write the store to a file, atomically replacing any previous one.
+    @param path, number of trees, number of root sketches, number of lattice nodes, offset of the index tables, input hash.
+    @return
+    '''
+    def save(self, path: str, num_trees: int, num_sketches: int, num_nodes: int, index_offset: int, input_hash: bytes = bytes(32)):
+        blob = bytearray()
+        string_offsets = array('I', [0])
+        for value in self.strings:
+            blob += value.encode('utf-8', 'surrogatepass')
+            string_offsets.append(len(blob))
+        header = STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, sys.version_info.major, sys.version_info.minor, input_hash,
+                                   len(self.words), len(self.strings), len(blob), num_trees, num_sketches, num_nodes, index_offset)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(header)
+            f.write(self.words.tobytes())
+            f.write(string_offsets.tobytes())
+            f.write(blob)
+        os.replace(temp_path, path)
+
+'''
+Encode a group key as a string: group keys are strings or AST node types.
+@param group key.
+@return string.
+'''
+def encode_group_key(key) -> str:
+    return f"type:{key.__name__}" if isinstance(key, type) else f"str:{key}"
+
+'''
+Decode a group key encoded by encode_group_key.
+@param string.
+@return group key.
+'''
+def decode_group_key(value: str):
+    kind, _, key = value.partition(":")
+    return getattr(ast, key) if kind == "type" else key
+
+'''
+Breadth-first builder of the refinement lattice below the root sketches: the 
+options of each hole of a sketch, and the sketches each option refines it 
+into, down to a depth, or until the lattice holds max_nodes sketches. 
+Sketches of the same trees are built once, so the lattice is a DAG. 
+@param depth, maximum number of sketches, anti-unification engine.
+'''
+class LatticeBuilder:
+    def __init__(self, depth: int = None, max_nodes: int = None, engine=None):
+        self.depth = LATTICE_DEPTH if depth is None else depth
+        self.max_nodes = LATTICE_MAX_NODES if max_nodes is None else max_nodes
+        self.engine = engine
+        self.ids = count()
+        # (reverse sketch, group key) of each node; the roots come first.
+        self.nodes = []
+        # <(tree fingerprints, counts), node number>.
+        self.numbers = {}
+        # <node number, per hole: None, or (option nodes, child nodes of each option)>.
+        self.expansions = {}
+        # (node number, depth) of the nodes left to expand.
+        self.queue = deque()
+
+    '''
+    Add a sketch, unless a sketch of the same trees is already a node.
+    @param reverse sketch, its group key, its depth.
+    @return node number.
+    '''
+    def add(self, reverse_sketch: ReverseSketch, key, depth: int) -> int:
+        node_key = (tuple(fingerprint(tree) for tree in reverse_sketch.trees), tuple(reverse_sketch.counts))
+        node_num = self.numbers.get(node_key)
+        if node_num is None:
+            node_num = self.numbers[node_key] = len(self.nodes)
+            self.nodes.append((reverse_sketch, key))
+            self.queue.append((node_num, depth))
+        return node_num
+
+    '''
+    Expand the holes of a node, as get_hole and update_hole would. A hole 
+    whose options and refinements would not fit in max_nodes, or that fails 
+    to expand, is left out, and is expanded on request instead. 
+    @param node number, its depth.
+    @return
+    '''
+    def expand(self, node_num: int, depth: int):
+        reverse_sketch, _ = self.nodes[node_num]
+        expansion = self.expansions[node_num] = [None] * len(reverse_sketch.holes)
+        for hole_num in range(len(reverse_sketch.holes)):
+            try:
+                group_dict, options = reverse_sketch.compute_expansion(hole_num)
+                refinements = []
+                for selected_group in group_dict.values():
+                    new_trees, new_counts = reverse_sketch.recover_groups(hole_num, selected_group, see_counts=True)
+                    refinements.append(trees_uppper_bounds(new_trees, self.engine, counts=new_counts, ids=self.ids))
+            except Exception:
+                # One bad hole must not fail the whole snapshot; the click on it will raise in its request. 
+                logger.warning("Not precomputing hole %d of sketch %s", hole_num, reverse_sketch, exc_info=True)
+                continue
+            if len(self.nodes) + len(options) + sum(len(child_sketches) for _, child_sketches in refinements) > self.max_nodes:
+                continue
+            option_nodes = [self.add(option, key, depth + 1) for key, option in zip(group_dict, options)]
+            children = [[self.add(child, key, depth + 1) for key, child in zip(child_dict, child_sketches)] for child_dict, child_sketches in refinements]
+            expansion[hole_num] = (option_nodes, children)
+
+    '''
+    Anti-unify the candidates into their root sketches, and expand breadth first.
+    @param candidate program ASTs.
+    @return number of root sketches.
+    '''
+    def build(self, trees: list[ast.AST]) -> int:
+        group_dict, reverse_sketches = trees_uppper_bounds(trees, self.engine, workers=ANTIUNIFY_WORKERS, ids=self.ids)
+        for key, reverse_sketch in zip(group_dict, reverse_sketches):
+            self.add(reverse_sketch, key, 0)
+        num_roots = len(self.nodes)
+        while self.queue and len(self.nodes) < self.max_nodes:
+            node_num, depth = self.queue.popleft()
+            if depth < self.depth:
+                self.expand(node_num, depth)
+        return num_roots
+
+'''
+Anti-unify candidate programs into their root sketches, build the lattice 
+below them, and write it to a sketch store. Each sketch's trees and counts 
+are one contiguous run of the index tables; trees shared by several sketches 
+are encoded once.
+@param candidate program ASTs, store path, anti-unification engine, sha256 of the candidates file, lattice depth, maximum number of sketches.
+@return (number of root sketches, number of lattice nodes).
+'''
+def build_sketch_store(trees: list[ast.AST], path: str, engine=None, input_hash: bytes = bytes(32), depth: int = None, max_nodes: int = None):
+    lattice = LatticeBuilder(depth, max_nodes, engine)
+    num_roots = lattice.build(trees)
+    writer = StoreWriter()
+    tree_offsets = array('I')
+    tree_counts = array('I')
+    sketch_records = []
+    for reverse_sketch, key in lattice.nodes:
+        first_tree = len(tree_offsets)
+        tree_offsets.extend(writer.encode_tree(tree) for tree in reverse_sketch.trees)
+        tree_counts.extend(reverse_sketch.counts)
+        sub_offsets = [writer.encode_tree(sub) for sub in reverse_sketch.sub_table]
+        sketch_records.append((writer.encode(reverse_sketch.sketch_AST), first_tree, reverse_sketch, key, sub_offsets))
+    # Index tables: tree offsets, tree counts, sketch record offsets, then the records.
+    index_offset = len(writer.words)
+    writer.words.extend(tree_offsets)
+    writer.words.extend(tree_counts)
+    records_offset = len(writer.words)
+    writer.words.extend([0] * len(sketch_records))
+    for node_num, (sketch_offset, first_tree, reverse_sketch, key, sub_offsets) in enumerate(sketch_records):
+        writer.words[records_offset + node_num] = len(writer.words)
+        writer.words.extend([sketch_offset, first_tree, len(reverse_sketch.trees), len(reverse_sketch.holes), len(sub_offsets), writer.string(encode_group_key(key)), 0])
+        writer.words.extend(sub_offsets)
+        for row in reverse_sketch.sub_ids:
+            writer.words.extend(row)
+    # Expansion tables of the expanded nodes. 
+    for node_num, expansion in lattice.expansions.items():
+        writer.words[writer.words[records_offset + node_num] + 6] = table = len(writer.words)
+        writer.words.extend([0] * len(expansion))
+        for hole_num, entry in enumerate(expansion):
+            if entry is None:
+                continue
+            option_nodes, children = entry
+            writer.words[table + hole_num] = len(writer.words)
+            writer.words.append(len(option_nodes))
+            writer.words.extend(option_nodes)
+            for child_nodes in children:
+                writer.words.append(len(child_nodes))
+                writer.words.extend(child_nodes)
+    writer.save(path, len(tree_offsets), num_roots, len(sketch_records), index_offset, input_hash)
+    return num_roots, len(sketch_records)
+
+'''
+Read-only view of a sketch store mapped into memory. Every worker process
+that opens the same file shares its pages; trees are decoded only when
+accessed, and nothing is copied out of the mapping until then.
+@param store path.
+'''
+class MappedSketchStore:
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mapping) < STORE_HEADER.size:
+            raise ValueError(f"{path} is not a sketch store")
+        magic, version, major, minor, self.input_hash, num_words, num_strings, num_bytes, self.num_trees, self.num_sketches, self.num_nodes, index_offset = STORE_HEADER.unpack_from(self.mapping)
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            raise ValueError(f"{path} is not a version {STORE_VERSION} sketch store")
+        if (major, minor) != sys.version_info[:2]:
+            raise ValueError(f"{path} was built by Python {major}.{minor}")
+        view = memoryview(self.mapping)
+        start = STORE_HEADER.size
+        self.words = view[start:start + 4 * num_words].cast('I')
+        start += 4 * num_words
+        self.string_offsets = view[start:start + 4 * (num_strings + 1)].cast('I')
+        start += 4 * (num_strings + 1)
+        self.string_bytes = view[start:start + num_bytes]
+        self.tree_offsets = self.words[index_offset:index_offset + self.num_trees]
+        self.tree_counts = self.words[index_offset + self.num_trees:index_offset + 2 * self.num_trees]
+        self.sketch_offsets = self.words[index_offset + 2 * self.num_trees:index_offset + 2 * self.num_trees + self.num_nodes]
+        # Decoded strings, and the shared parts of each sketch, built on first use.
+        self.strings = [None] * num_strings
+        self.sketches = [None] * self.num_nodes
+
+    '''
+    A string of the string table.
+    @param index.
+    @return string.
+    '''
+    def string(self, index: int) -> str:
+        value = self.strings[index]
+        if value is None:
+            value = self.strings[index] = bytes(self.string_bytes[self.string_offsets[index]:self.string_offsets[index + 1]]).decode('utf-8', 'surrogatepass')
+        return value
+
+    '''
+    Decode the value encoded at an offset of the words.
+    @param offset.
+    @return (AST, list of ASTs or primitive field value, offset past its encoding).
+    '''
+    def decode(self, offset: int):
+        word = self.words[offset]
+        tag, payload = word & 0xF, word >> 4
+        offset += 1
+        if tag == TAG_NODE:
+            node_type = getattr(ast, self.string(payload))
+            fields = {}
+            for k in node_type._fields:
+                fields[k], offset = self.decode(offset)
+            node = node_type(**fields)
+            # Locations are not stored, but ast.unparse reads the line of statements that can carry a type comment. 
+            if 'type_comment' in node_type._fields:
+                node.lineno = 1
+            return node, offset
+        if tag == TAG_LIST:
+            items = []
+            for _ in range(payload):
+                value, offset = self.decode(offset)
+                items.append(value)
+            return items, offset
+        if tag == TAG_HOLE:
+            hole = ast.Name(id='?', ctx="")
+            hole.hole_id = payload
+            hole.is_hole = True
+            return hole, offset
+        if tag == TAG_STR:
+            return self.string(payload), offset
+        if tag == TAG_INT:
+            return int(self.string(payload)), offset
+        if tag == TAG_BOOL:
+            return bool(payload), offset
+        if tag == TAG_BYTES:
+            return self.string(payload).encode('latin-1'), offset
+        if tag == TAG_FLOAT:
+            return DOUBLE.unpack(self.words[offset:offset + 2].tobytes())[0], offset + 2
+        if tag == TAG_COMPLEX:
+            data = self.words[offset:offset + 4].tobytes()
+            return complex(DOUBLE.unpack(data[:8])[0], DOUBLE.unpack(data[8:])[0]), offset + 4
+        if tag == TAG_ELLIPSIS:
+            return Ellipsis, offset
+        return None, offset
+
+    '''
+    Decode the tree encoded at an offset.
+    @param offset.
+    @return AST.
+    '''
+    def tree(self, offset: int) -> ast.AST:
+        return self.decode(offset)[0]
+
+    '''
+    The process-wide, read-only parts of a sketch of the lattice.
+    @param node number.
+    @return (sketch AST, trees, counts, number of holes, substitution table, lookup, id rows).
+    '''
+    def sketch_parts(self, node_num: int):
+        parts = self.sketches[node_num]
+        if parts is None:
+            record = self.sketch_offsets[node_num]
+            sketch_offset, first_tree, num_trees, num_holes, num_subs = self.words[record:record + 5]
+            subs_start = record + 7
+            rows_start = subs_start + num_subs
+            trees = StoredTrees(self, self.tree_offsets[first_tree:first_tree + num_trees])
+            counts = self.tree_counts[first_tree:first_tree + num_trees]
+            sub_table = StoredTrees(self, self.words[subs_start:rows_start])
+            sub_ids = [self.words[rows_start + hole_num * num_trees:rows_start + (hole_num + 1) * num_trees] for hole_num in range(num_holes)]
+            parts = self.sketches[node_num] = (self.tree(sketch_offset), trees, counts, num_holes, sub_table, StoredLookup(sub_table), sub_ids)
+        return parts
+
+    '''
+    Group key of a sketch of the lattice.
+    @param node number.
+    @return group key.
+    '''
+    def group_key(self, node_num: int):
+        return decode_group_key(self.string(self.words[self.sketch_offsets[node_num] + 5]))
+
+    '''
+    Group keys of the root sketches, in sketch order.
+    @param
+    @return list of group keys.
+    '''
+    def group_keys(self):
+        return [self.group_key(sketch_num) for sketch_num in range(self.num_sketches)]
+
+    '''
+    Candidate programs grouped as trees_uppper_bounds groups them.
+    @param
+    @return <group key, trees>
+    '''
+    def root_groups(self):
+        return {key: self.sketch_parts(sketch_num)[1] for sketch_num, key in enumerate(self.group_keys())}
+
+    '''
+    The precomputed expansion of a hole of a sketch of the lattice.
+    @param node number, hole number.
+    @return (option nodes, child nodes of each option), or None if it was not precomputed.
+    '''
+    def expansion(self, node_num: int, hole_num: int):
+        record = self.sketch_offsets[node_num]
+        table = self.words[record + 6]
+        if not table or not 0 <= hole_num < self.words[record + 3]:
+            return None
+        offset = self.words[table + hole_num]
+        if not offset:
+            return None
+        num_options = self.words[offset]
+        option_nodes = self.words[offset + 1:offset + 1 + num_options].tolist()
+        offset += 1 + num_options
+        children = []
+        for _ in range(num_options):
+            num_children = self.words[offset]
+            children.append(self.words[offset + 1:offset + 1 + num_children].tolist())
+            offset += 1 + num_children
+        return option_nodes, children
+
+    '''
+    A sketch of the lattice for one session. The data is shared with every
+    other session; only the navigation state (ids, children, parent data) is new.
+    @param node number, id allocator of the session.
+    @return reverse sketch.
+    '''
+    def sketch(self, node_num: int, ids) -> ReverseSketch:
+        sketch_AST, trees, counts, num_holes, sub_table, sub_lookup, sub_ids = self.sketch_parts(node_num)
+        reverse_sketch = ReverseSketch(next(ids), sketch_AST, trees, [f"x_{i}" for i in range(num_holes)], [], counts, ids)
+        reverse_sketch.sub_table = sub_table
+        reverse_sketch.sub_lookup = sub_lookup
+        reverse_sketch.sub_ids = sub_ids
+        reverse_sketch.lattice = (self, node_num)
+        return reverse_sketch
+
+    '''
+    Root sketches for one session.
+    @param id allocator of the session.
+    @return list of reverse sketches.
+    '''
+    def root_sketches(self, ids) -> list[ReverseSketch]:
+        return [self.sketch(sketch_num, ids) for sketch_num in range(self.num_sketches)]
+
+'''
+Trees of a sketch store, decoded on each access.
+@param store, offsets of the trees in its words.
+'''
+class StoredTrees(Sequence):
+    def __init__(self, store: MappedSketchStore, offsets):
+        self.store = store
+        self.offsets = offsets
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.store.tree(offset) for offset in self.offsets[index]]
+        return self.store.tree(self.offsets[index])
+
+    def __len__(self):
+        return len(self.offsets)
+
+'''
+<fingerprint, index> of stored substitutions, built on first lookup.
+Fingerprints are computed from the decoded trees, so the file doesn't store them.
+@param stored substitution table.
+'''
+class StoredLookup(Mapping):
+    def __init__(self, sub_table: StoredTrees):
+        self.sub_table = sub_table
+        self.table = None
+
+    def lookup(self):
+        table = self.table
+        if table is None:
+            # Every session shares the store's sketches; publish the table only once it is complete. 
+            table = {}
+            for sub_id, sub in enumerate(self.sub_table):
+                table.setdefault(fingerprint(sub), sub_id)
+            self.table = table
+        return table
+
+    def __getitem__(self, fp):
+        return self.lookup()[fp]
+
+    def __iter__(self):
+        return iter(self.lookup())
+
+    def __len__(self):
+        return len(self.sub_table)
+
+# The process's mapping of the sketch store; opened on first use.
+SKETCH_STORE = None
+SKETCH_STORE_LOCK = threading.Lock()
+
+'''
+Hash the contents of a file. 
+@param path. 
+@return sha256 digest. 
+'''
+def file_sha256(path: str) -> bytes:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+'''
+Parse the candidates and write the snapshot of their sketch lattice. 
+@param candidates path, snapshot path, anti-unification engine, lattice depth, maximum number of sketches. 
+@return (number of root sketches, number of lattice nodes). 
+'''
+def build_snapshot(input_path: str = None, output_path: str = None, engine=None, depth: int = None, max_nodes: int = None):
+    input_path = CANDIDATES_FILE if input_path is None else input_path
+    output_path = SKETCH_STORE_FILE if output_path is None else output_path
+    return build_sketch_store(read_trees(input_path), output_path, engine, file_sha256(input_path), depth, max_nodes)
+
+'''
+Open a snapshot if it is valid for the candidates. 
+@param snapshot path, sha256 of the candidates file. 
+@return MappedSketchStore, or None if it is missing, stale or unreadable. 
+'''
+def open_snapshot(path: str, input_hash: bytes):
+    if not os.path.exists(path):
+        return None
+    try:
+        store = MappedSketchStore(path)
+    except ValueError as e:
+        logger.warning("Ignoring snapshot %s: %s", path, e)
+        return None
+    return store if store.input_hash == input_hash else None
+
+'''
+Map the snapshot of the candidate programs, rebuilding it first if it is 
+missing, from another version, or built from different candidates. 
+@param
+@return MappedSketchStore.
+'''
+def sketch_store() -> MappedSketchStore:
+    global SKETCH_STORE
+    with SKETCH_STORE_LOCK:
+        if SKETCH_STORE is None:
+            input_hash = file_sha256(CANDIDATES_FILE)
+            SKETCH_STORE = open_snapshot(SKETCH_STORE_FILE, input_hash)
+            if SKETCH_STORE is None:
+                build_sketch_store(read_trees(CANDIDATES_FILE), SKETCH_STORE_FILE, input_hash=input_hash)
+                SKETCH_STORE = MappedSketchStore(SKETCH_STORE_FILE)
+    return SKETCH_STORE
+
+# The candidates, alpha-renamed; loaded on first use when ALPHA_RENAME is on. 
+CANONICAL_TREES = None
+
+'''
+Read the candidate programs and canonicalize them up to renaming of their 
+bound identifiers, once per process; each keeps its original for display. 
+@param
+@return list of canonical ASTs.
+'''
+def canonical_trees() -> list[ast.AST]:
+    global CANONICAL_TREES
+    with SKETCH_STORE_LOCK:
+        if CANONICAL_TREES is None:
+            CANONICAL_TREES = [alpha_canonicalize(tree) for tree in read_trees(CANDIDATES_FILE)]
+    return CANONICAL_TREES
+
 app = Flask(__name__)
 
-# Temporary memory structure; The array stores the JSON reps of the reverse sketches. 
-# JSON representation of the original reverse sketches. 
-REVERSE_SKETCHES_ORIGINAL = []
-# Original reverse sketch class objects. 
-REVERSE_SKETCHES_ORIGINAL_OBJS = []
-# JSON representation of reverse sketch class objects. 
-REVERSE_SKETCHES = []
-# Reverse sketch class objects. 
-REVERSE_SKETCHES_OBJS = []
-# Previously viewed reverse sketch JSON representations. 
-REVERSE_SKETCHES_HISTORY = []
-# Previously viewed reverse sketch class objects. 
-REVERSE_SKETCHES_HISTORY_OBJS = []
-# The previously seen options. 
-PREVIOUS_OPTIONS = []
+'''
+Registry of every reverse sketch a session has produced. It owns the sketch 
+objects and their JSON views, indexed by id and by parent data, so lookups do 
+not scan the history. Registering a sketch again is a no-op. The sketches of 
+a (parent id, hole, option) are kept together, so revisiting a hole reuses 
+them; once one of them is evicted or moves to another parent, they are all 
+forgotten and regenerated on the next visit. Past maxsize, the least recently 
+used sketches are evicted, except the roots and the current navigation path, 
+which are pinned. 
+@param maximum number of sketches kept. 
+'''
+class SketchRegistry:
+    def __init__(self, maxsize: int = None):
+        self.maxsize = HISTORY_SIZE if maxsize is None else maxsize
+        # <sketch id, ReverseSketch>, least recently used first. 
+        self.objs = OrderedDict()
+        # <sketch id, JSON representation>. 
+        self.jsons = dict()
+        # <(parent sketch id, hole number, option number), list of ReverseSketch>. 
+        self.by_parent = dict()
+        # Ids that are never evicted: the roots, and the current navigation path. 
+        self.roots = set()
+        self.path = set()
+
+    '''
+    Register a reverse sketch. 
+    @param reverse sketch. 
+    @return 
+    '''
+    def add(self, reverse_sketch: ReverseSketch):
+        if reverse_sketch.id not in self.objs:
+            self.objs[reverse_sketch.id] = reverse_sketch
+            self.jsons[reverse_sketch.id] = reverse_sketch.generate_json()
+        # The parent data is set before registration, and may be set again on a reused sketch. 
+        if reverse_sketch.parent_data:
+            children = self.by_parent.setdefault(self.parent_key(reverse_sketch), [])
+            if all(child is not reverse_sketch for child in children):
+                children.append(reverse_sketch)
+
+    '''
+    Register the root sketches, which are pinned for the whole session. 
+    @param list of reverse sketches. 
+    @return 
+    '''
+    def add_roots(self, reverse_sketches):
+        self.roots.update(reverse_sketch.id for reverse_sketch in reverse_sketches)
+        self.extend(reverse_sketches)
+
+    '''
+    Pin the current navigation path, unpinning the previous one, and evict 
+    what no longer fits. Sketches are only evicted here, once the new path is known. 
+    @param the sketch being viewed, and the sketches it currently offers. 
+    @return 
+    '''
+    def set_path(self, reverse_sketch: ReverseSketch, children=()):
+        self.path = {ancestor.id for ancestor in self.ancestors(reverse_sketch)}
+        self.path.update(child.id for child in children)
+        self.evict()
+
+    '''
+    The sketch and the sketches it was expanded from, up to its root. 
+    @param reverse sketch. 
+    @return list of reverse sketches, the sketch first. 
+    '''
+    def ancestors(self, reverse_sketch: ReverseSketch):
+        chain = []
+        seen = set()
+        while reverse_sketch is not None and reverse_sketch.id not in seen:
+            chain.append(reverse_sketch)
+            seen.add(reverse_sketch.id)
+            parent_id = reverse_sketch.parent_data.get('sketch_id')
+            reverse_sketch = self.objs.get(parent_id)
+        return chain
+
+    '''
+    Evict least recently used sketches until the registry fits in maxsize. 
+    @param 
+    @return 
+    '''
+    def evict(self):
+        if len(self.objs) <= self.maxsize:
+            return
+        for sketch_id in [sketch_id for sketch_id in self.objs if sketch_id not in self.roots and sketch_id not in self.path]:
+            reverse_sketch = self.objs.pop(sketch_id)
+            del self.jsons[sketch_id]
+            # Its siblings are regenerated with it. 
+            if reverse_sketch.parent_data and any(child is reverse_sketch for child in self.by_parent.get(self.parent_key(reverse_sketch), ())):
+                del self.by_parent[self.parent_key(reverse_sketch)]
+            # Its expansions are unreachable now. 
+            EXPANSION_CACHE.invalidate(reverse_sketch)
+            if len(self.objs) <= self.maxsize:
+                return
+
+    '''
+    Index key of a sketch's parent data. 
+    @param reverse sketch. 
+    @return (parent sketch id, hole number, option number)
+    '''
+    @staticmethod
+    def parent_key(reverse_sketch: ReverseSketch):
+        parent_data = reverse_sketch.parent_data
+        return parent_data['sketch_id'], parent_data['hole_num'], parent_data['option_num']
+
+    '''
+    Register several reverse sketches. 
+    @param list of reverse sketches. 
+    @return 
+    '''
+    def extend(self, reverse_sketches):
+        for reverse_sketch in reverse_sketches:
+            self.add(reverse_sketch)
+
+    '''
+    Find a reverse sketch by ID. 
+    @param ID
+    @return the ReverseSketch with that ID, or None. 
+    '''
+    def get(self, sketch_id: int):
+        reverse_sketch = self.objs.get(sketch_id)
+        # Mark it as recently used. 
+        if reverse_sketch is not None:
+            self.objs.move_to_end(sketch_id)
+        return reverse_sketch
+
+    '''
+    Find a reverse sketch's JSON representation by ID. 
+    @param ID
+    @return the JSON representation, or None. 
+    '''
+    def get_json(self, sketch_id: int):
+        return self.jsons.get(sketch_id)
+
+    '''
+    Find the reverse sketches generated for an option of a parent's hole. 
+    @param parent sketch ID, hole number, option number. 
+    @return list of reverse sketches, or None if they must be generated (again). 
+    '''
+    def get_children(self, sketch_id: int, hole_num: int, option_num: int):
+        key = (sketch_id, hole_num, option_num)
+        children = self.by_parent.get(key)
+        if children is None:
+            return None
+        # A sketch shared by another hole was re-parented since. 
+        if any(child.id not in self.objs or self.parent_key(child) != key for child in children):
+            del self.by_parent[key]
+            return None
+        for child in children:
+            self.objs.move_to_end(child.id)
+        return list(children)
+
+    '''
+    Find the reverse sketch generated for an option of a parent's hole. 
+    @param parent sketch ID, hole number, option number. 
+    @return the ReverseSketch, or None. 
+    '''
+    def get_child(self, sketch_id: int, hole_num: int, option_num: int):
+        children = self.get_children(sketch_id, hole_num, option_num)
+        return children[0] if children else None
+
+    def __len__(self):
+        return len(self.objs)
+
+    def __contains__(self, sketch_id):
+        return sketch_id in self.objs
+
+    def __iter__(self):
+        return iter(self.objs.values())
+
+'''
+Exploration state of one session: its sketch tree, history and id allocator. 
+Requests of the same session are serialized by the workspace lock; requests 
+of different sessions share no state and run in parallel. 
+@param 
+'''
+class Workspace:
+    def __init__(self):
+        self.lock = threading.RLock()
+        # Source of sketch ids; each session numbers its sketches from 0. 
+        self.ids = count()
+        # Background load of the dataset the session explores, if it submitted one. 
+        self.job = None
+        self.reset()
+
+    '''
+    Forget the sketches explored so far, e.g. before exploring another dataset. 
+    Ids keep counting, so links to forgotten sketches don't reach new ones. 
+    @param 
+    @return 
+    '''
+    def reset(self):
+        # JSON representation of the original reverse sketches. 
+        self.original = []
+        # Original reverse sketch class objects. 
+        self.original_objs = []
+        # JSON representation of reverse sketch class objects. 
+        self.reverse_sketches = []
+        # Reverse sketch class objects. 
+        self.reverse_sketches_objs = []
+        # Previously viewed reverse sketch class objects, and their JSON representations. 
+        self.history = SketchRegistry()
+        # The previously seen options. 
+        self.previous_options = []
+        # Expansions scheduled for the page the session is viewing. 
+        self.prefetches = []
+
+    '''
+    Cancel the expansions prefetched for the previous page that have not started. 
+    @param 
+    @return 
+    '''
+    def cancel_prefetches(self):
+        for future in self.prefetches:
+            future.cancel()
+        self.prefetches = []
+
+    '''
+    Prefetch the expansions of the holes of the page being viewed. 
+    @param list of reverse sketches, the viewed one first. 
+    @return 
+    '''
+    def prefetch(self, reverse_sketches):
+        self.cancel_prefetches()
+        self.prefetches = prefetch_expansions(reverse_sketches)
+
+# <session token, Workspace>, least recently used first. 
+WORKSPACES = OrderedDict()
+# Guards WORKSPACES only; never held while a request is being served. 
+WORKSPACES_LOCK = threading.Lock()
+
+'''
+The key that signs session cookies. Every worker process, and every restart, 
+must use the same key, or sessions are lost between them: it is read from 
+OVERSYNTH_SECRET_KEY, or else from a file, which is generated once. 
+@param path of the key file. 
+@return secret key. 
+'''
+def load_secret_key(path: str) -> str:
+    key = os.environ.get("OVERSYNTH_SECRET_KEY")
+    if key:
+        return key
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}"
+        with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            f.write(secrets.token_hex(32))
+        # Workers starting together race to publish their key; the first one wins and every worker reads it. 
+        try:
+            os.link(temp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temp_path)
+    with open(path) as f:
+        return f.read().strip()
+
+app.secret_key = load_secret_key(os.path.join(app.instance_path, "secret_key"))
+
+'''
+The workspace of the session making the current request. 
+@param whether to create it if the session has none (yet, or any more). 
+@return Workspace, or None. 
+'''
+def current_workspace(create: bool = False) -> Workspace:
+    if g.get('workspace') is None:
+        token = session.get('workspace')
+        with WORKSPACES_LOCK:
+            workspace = WORKSPACES.get(token) if token is not None else None
+            if workspace is not None:
+                WORKSPACES.move_to_end(token)
+            elif create:
+                token = session['workspace'] = secrets.token_hex(16)
+                workspace = WORKSPACES[token] = Workspace()
+                # Drop the least recently used session. 
+                if len(WORKSPACES) > WORKSPACES_SIZE:
+                    WORKSPACES.popitem(last=False)
+        g.workspace = workspace
+    return g.workspace
+
+'''
+Serve a view while holding its session's workspace lock. Only views that 
+start a session's exploration create its workspace; the others are not found 
+without one, so requests without a session cookie cannot evict real sessions. 
+@param view function, whether the view creates the workspace. 
+@return locked view function. 
+'''
+def with_workspace(view=None, create: bool = False):
+    if view is None:
+        return partial(with_workspace, create=create)
+    @wraps(view)
+    def locked_view(*args, **kwargs):
+        workspace = current_workspace(create)
+        if workspace is None:
+            abort(404)
+        with workspace.lock:
+            return view(*args, **kwargs)
+    return locked_view
+
+'''
+Background load of a candidate dataset: parsing, then anti-unification of the 
+root sketches, off the request threads. Its progress is only written by the 
+job's thread, and is read by status requests without a lock. 
+@param job id, candidate lines (None loads CANDIDATES_FILE), id allocator of the session. 
+'''
+class LoadJob:
+    def __init__(self, job_id: str, lines, ids):
+        self.id = job_id
+        self.lines = lines
+        self.ids = ids
+        # queued, parsing, antiunifying, done or failed. 
+        self.state = "queued"
+        self.trees_parsed = 0
+        self.groups_done = 0
+        self.groups_total = None
+        self.submitted = time.monotonic()
+        self.finished = None
+        self.error = None
+        # The root sketches, once done. 
+        self.reverse_sketches = None
+
+    '''
+    Load the dataset. Failures are recorded in the job, not raised. 
+    @param 
+    @return 
+    '''
+    def run(self):
+        try:
+            self.state = "parsing"
+            trees = []
+            for chunk in iter_trees(CANDIDATES_FILE if self.lines is None else f"job {self.id}", lines=self.lines):
+                # Collapse candidates that only differ by renaming their local variables. 
+                if ALPHA_RENAME:
+                    chunk = [alpha_canonicalize(tree) for tree in chunk]
+                trees.extend(chunk)
+                self.trees_parsed = len(trees)
+            self.state = "antiunifying"
+            _, self.reverse_sketches = trees_uppper_bounds(trees, workers=ANTIUNIFY_WORKERS, ids=self.ids, progress=self.update_groups)
+            self.state = "done"
+        except Exception as e:
+            logger.exception("Load job %s failed", self.id)
+            self.error = str(e)
+            self.state = "failed"
+        finally:
+            self.finished = time.monotonic()
+
+    '''
+    Progress callback of trees_uppper_bounds. 
+    @param groups anti-unified, groups. 
+    @return 
+    '''
+    def update_groups(self, groups_done: int, groups_total: int):
+        self.groups_done = groups_done
+        self.groups_total = groups_total
+
+    '''
+    Status of the job. 
+    @param 
+    @return JSON representation of the job. 
+    '''
+    def status(self):
+        return {
+            'id': self.id,
+            'state': self.state,
+            'trees_parsed': self.trees_parsed,
+            'groups_done': self.groups_done,
+            'groups_total': self.groups_total,
+            'elapsed': round((self.finished or time.monotonic()) - self.submitted, 3),
+            'error': self.error
+        }
+
+# <job id, LoadJob>, oldest first. 
+JOBS = OrderedDict()
+JOBS_LOCK = threading.Lock()
+# Threads running the jobs; started on first use. 
+JOB_POOL = None
+
+'''
+Start loading a dataset in the background. Past JOBS_SIZE jobs, the oldest 
+finished ones are forgotten. 
+@param candidate lines (None loads CANDIDATES_FILE), id allocator of the session. 
+@return LoadJob. 
+'''
+def submit_load_job(lines, ids) -> LoadJob:
+    global JOB_POOL
+    job = LoadJob(secrets.token_hex(8), lines, ids)
+    with JOBS_LOCK:
+        if JOB_POOL is None:
+            JOB_POOL = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="load-job")
+        JOBS[job.id] = job
+        for job_id in [job_id for job_id, old_job in JOBS.items() if old_job.finished is not None][:max(0, len(JOBS) - JOBS_SIZE)]:
+            del JOBS[job_id]
+        JOB_POOL.submit(job.run)
+    return job
+
+'''
+The candidate lines sent with a request: a 'candidates' file upload, a JSON 
+body {"candidates": string or list of lines}, or a plain text body. 
+@param 
+@return list of lines, or None if the request has no dataset. 
+'''
+def request_candidate_lines():
+    if 'candidates' in request.files:
+        return request.files['candidates'].read().decode('utf-8').splitlines()
+    if request.is_json:
+        candidates = (request.get_json(silent=True) or {}).get('candidates')
+        if isinstance(candidates, str):
+            return candidates.splitlines()
+        if isinstance(candidates, list) and all(isinstance(line, str) for line in candidates):
+            return candidates
+        abort(400)
+    text = request.get_data(as_text=True)
+    return text.splitlines() if text else None
+
+'''
+Response reporting a job's status, pointing at its status URL. 
+@param LoadJob, HTTP status. 
+@return response. 
+'''
+def job_response(job: LoadJob, status_code: int):
+    response = jsonify(job.status())
+    response.status_code = status_code
+    response.headers['Location'] = url_for('get_job', job_id=job.id)
+    return response
 
 '''
 Generate a color map.
@@ -544,13 +2562,7 @@ Find the ReverseSketch object by ID.
 @return the ReverseObject with that ID.
 '''
 def findObjByID(id: int) -> ReverseSketch:
-    global REVERSE_SKETCHES_HISTORY_OBJS
-    # print("Objects: ", REVERSE_SKETCHES_HISTORY_OBJS)
-    for obj in REVERSE_SKETCHES_HISTORY_OBJS: 
-        if obj.id == id:
-            return obj
-        # print("ID: ", obj.id, obj)
-    return None
+    return current_workspace().history.get(id)
 
 '''
 Find the ReverseSketch JSON rep by ID.  
@@ -558,11 +2570,7 @@ Find the ReverseSketch JSON rep by ID.
 @return the reverse sketch JSON with that ID.
 '''
 def findJsonByID(id: int): 
-    global REVERSE_SKETCHES_HISTORY
-    for obj in REVERSE_SKETCHES_HISTORY: 
-        if obj['id'] == id: 
-            return obj
-    return None
+    return current_workspace().history.get_json(id)
 
 '''
 Find the ReverseSketch object by clickable sketch.  
@@ -570,12 +2578,7 @@ Find the ReverseSketch object by clickable sketch.
 @return the ReverseObject with that clickable sketch.
 '''
 def findJsonByParentData(sketch_id: int, hole_id: int, option_num: int) -> ReverseSketch:
-    global REVERSE_SKETCHES_HISTORY_OBJS
-    for obj in REVERSE_SKETCHES_HISTORY_OBJS: 
-        if obj.parent_data:
-            if obj.matches_parent_data(sketch_id, hole_id, option_num):
-                return obj
-    return None
+    return current_workspace().history.get_child(sketch_id, hole_id, option_num)
 
 '''
 Print nested children utility.  
@@ -585,7 +2588,8 @@ Print nested children utility.
 def pretty_print_children_util(obj: ReverseSketch):
     """ return a family tree for a Person object """
 
-    children = list(set(obj.children))
+    # Skip children that were evicted from the history. 
+    children = [child for child in set(obj.children) if child in current_workspace().history]
 
     if not children:
         # this person has no children, recursion ends here
@@ -608,7 +2612,7 @@ Print nested children.
 def pretty_print_children():
     print("Pretty Print!")
     overview = []
-    for obj in REVERSE_SKETCHES_ORIGINAL_OBJS:
+    for obj in current_workspace().original_objs:
         family_tree = pretty_print_children_util(obj)
         overview.append(family_tree)
     print("Overview loook: ", overview)
@@ -661,7 +2665,8 @@ def generate_navigation3(overview, selected_sketch, color_map, color_children =
             html_overview += "<li class='selected'>"
         else:
             html_overview += "<li>"
-        if (color_children and (family_tree in direct_children)):
+        # Children of the sketch's other holes have no color of their own. 
+        if (color_children and (family_tree in direct_children) and color_count < len(color_map)):
             print("Color count: ", color_count, color_map)
             html_overview += f"<span style=background-color:{list(color_map.values())[color_count]};>{family_tree['name']}</span>"
         else:
@@ -696,60 +2701,93 @@ def generate_navigation3(overview, selected_sketch, color_map, color_children =
 
 # Routes.
 @app.route('/oversynth/api/v1.0/sketches', methods=['GET'])
+@with_workspace(create=True)
 def get_sketches():
-    global REVERSE_SKETCHES
-    global REVERSE_SKETCHES_OBJS
-    global REVERSE_SKETCHES_ORIGINAL
+    # The requesting session's state. 
+    workspace = current_workspace()
+    # The session's dataset is still loading, or failed to; report the job instead of waiting. 
+    if not workspace.reverse_sketches and workspace.job is not None and workspace.job.state != "done":
+        return job_response(workspace.job, 500 if workspace.job.state == "failed" else 202)
     # If reverse sketches is empty, populate with the highest-level sketches. 
-    if not REVERSE_SKETCHES:
+    if not workspace.reverse_sketches:
         # Host link.
         host = "http://127.0.0.1:5000/"
-        # ASTs that represent the candidate programs.
-        trees = read_trees("ex-input.txt")
-        # trees = read_multi_line_trees()
         # Version 
         version = "v1.0"
-        # Generate the reverse sketches. 
-        _, reverse_sketches = trees_uppper_bounds(trees)
+        # The session's own dataset, loaded in the background. 
+        if workspace.job is not None:
+            reverse_sketches = workspace.job.reverse_sketches
+        # Collapse candidates that only differ by renaming their local variables. 
+        elif ALPHA_RENAME:
+            # ASTs that represent the candidate programs, canonicalized once per process.
+            trees = canonical_trees()
+            # trees = read_multi_line_trees()
+            # Generate the reverse sketches. 
+            _, reverse_sketches = trees_uppper_bounds(trees, workers=ANTIUNIFY_WORKERS, ids=workspace.ids)
+        else:
+            # The root sketches are shared by every session and worker, through the mapped store. 
+            reverse_sketches = sketch_store().root_sketches(workspace.ids)
         # Store the original reverse sketches JSON representations. 
-        REVERSE_SKETCHES_ORIGINAL.extend([obj.generate_json() for obj in reverse_sketches])
+        workspace.original.extend([obj.generate_json() for obj in reverse_sketches])
         # Store the original reverse sketches class objects. 
-        REVERSE_SKETCHES_ORIGINAL_OBJS.extend([obj for obj in reverse_sketches])
-        # Update the sketch history array by adding the current sketches 
-        REVERSE_SKETCHES_HISTORY.extend([obj.generate_json() for obj in reverse_sketches])
-        # Update the sketch history array by adding the current sketches Reverse Sketch class instance.  
-        REVERSE_SKETCHES_HISTORY_OBJS.extend([obj for obj in reverse_sketches])
+        workspace.original_objs.extend([obj for obj in reverse_sketches])
+        # Register the current sketches in the history; the roots are never evicted. 
+        workspace.history.add_roots(reverse_sketches)
         # Set reverse sketches to a list of JSON objects for each reverse sketch. 
-        REVERSE_SKETCHES_OBJS = [obj for obj in reverse_sketches]
+        workspace.reverse_sketches_objs = [obj for obj in reverse_sketches]
         # Update the JSON representations to include sketches with clickable holes. 
-        REVERSE_SKETCHES = [obj.generate_json() for obj in reverse_sketches]
+        workspace.reverse_sketches = [obj.generate_json() for obj in reverse_sketches]
         # Generate the clickable sketches.
-        for sketch in REVERSE_SKETCHES_ORIGINAL_OBJS:
-            sketch.update_clickable_sketch(createClickableSketch(host, version, sketch.id, ast.unparse(sketch.sketch_AST)))
+        for sketch in workspace.original_objs:
+            sketch.update_clickable_sketch(createClickableSketch(host, version, sketch.id, unparse(sketch.sketch_AST)))
         # Generate clickable sketches.
-        clickable_sketches = updateJsonStringReps(host, version, REVERSE_SKETCHES_ORIGINAL)
+        clickable_sketches = updateJsonStringReps(host, version, workspace.original)
+        # Expand the holes of the root sketches while the page is read. 
+        workspace.prefetch(workspace.reverse_sketches_objs)
         # Return a jsonified REVERSE_SKETCH.
-        return render_template("home.html", sketches_len=len(REVERSE_SKETCHES), sketches=clickable_sketches)
+        return render_template("home.html", sketches_len=len(workspace.reverse_sketches), sketches=clickable_sketches)
     # If the reverse sketches are not empty, return them. 
     else: 
+        # Expand the holes of the current sketches while the page is read. 
+        workspace.prefetch(workspace.reverse_sketches_objs)
          # Return a jsonified REVERSE_SKETCH.
-        return render_template("home.html", sketches_len=len(REVERSE_SKETCHES), sketches=REVERSE_SKETCHES)
+        return render_template("home.html", sketches_len=len(workspace.reverse_sketches), sketches=workspace.reverse_sketches)
 
 @app.route('/oversynth/api/v1.0/sketches/<int:sketch_id>', methods=['GET'])
+@with_workspace
 def get_sketch(sketch_id):
-    global REVERSE_SKETCHES
+    # The requesting session's state. 
+    workspace = current_workspace()
     # If the reverse sketches are empty, abort. 
-    if not len(REVERSE_SKETCHES) or len(REVERSE_SKETCHES) <= sketch_id:
+    if not len(workspace.reverse_sketches) or len(workspace.reverse_sketches) <= sketch_id:
         abort(404)
     # If the reverse sketches are not empty, return the sketch_id-th sketch. 
-    return jsonify(REVERSE_SKETCHES[sketch_id])
+    return jsonify(workspace.reverse_sketches[sketch_id])
+
+@app.route('/oversynth/api/v1.0/sketches/<int:sketch_id>/<int:hole_num>/options', methods=['GET'])
+@with_workspace
+def get_hole_options(sketch_id, hole_num):
+    # The requesting session's state. 
+    workspace = current_workspace()
+    # The Reverse Sketch class instance of the selected sketch. 
+    selected_reverse_sketch = findObjByID(sketch_id)
+    # If the sketch is unknown, or it has no such hole, abort. 
+    if not selected_reverse_sketch or not 0 <= hole_num < len(selected_reverse_sketch.holes):
+        abort(404)
+    # Expand only the requested hole. 
+    return jsonify({
+        'id': sketch_id,
+        'hole': hole_num,
+        'options': selected_reverse_sketch.hole_option_strs(hole_num)
+    })
 
 @app.route('/oversynth/api/v1.0/sketches/<int:sketch_id>/<int:hole_id>', methods=['GET'])
+@with_workspace
 def get_hole(sketch_id, hole_id):
-    global REVERSE_SKETCHES
-    global REVERSE_SKETCHES_HISTORY
-    global REVERSE_SKETCHES_ORIGINAL
-    global PREVIOUS_OPTIONS
+    # The requesting session's state. 
+    workspace = current_workspace()
+    # The user moved on; drop what was prefetched for the previous page. 
+    workspace.cancel_prefetches()
 
     '''
     Generate new sketches that represent the sketch with a filled hole.   
@@ -767,41 +2805,41 @@ def get_hole(sketch_id, hole_id):
             # Store the current parent id. 
             parent_id = selected_reverse_sketch.id
             # Update the clickable sketch.
-            sketch.update_clickable_sketch(createClickableSketch(host, version, sketch.id, ast.unparse(sketch.sketch_AST)))
+            sketch.update_clickable_sketch(createClickableSketch(host, version, sketch.id, unparse(sketch.sketch_AST)))
             # Update the parent data. 
             sketch.update_parent_data(parent_id, hole_num, 0)
             # Set teh concrete program to be the new reverse sketch. 
             new_sketches = [sketch]
-            # Add the new sketch to the REVERSE SKETCHES. 
-            REVERSE_SKETCHES_HISTORY_OBJS.extend(hole_options)
-            # Update the sketch history array by adding the current sketches 
-            REVERSE_SKETCHES_HISTORY.extend([obj.generate_json() for obj in hole_options])
+            # Register the new sketch in the history. 
+            workspace.history.extend(hole_options)
         else:
             for option_num, hole_option in enumerate(hole_options):
                 # print(f'{option_num}: {hole_option}')
+                # The option was opened before: reuse its sketches and their ids. 
+                new_reverse_sketches = workspace.history.get_children(selected_reverse_sketch.id, hole_num, option_num)
+                if new_reverse_sketches is not None:
+                    new_sketches.extend(new_reverse_sketches)
+                    continue
                 # Retrive all of the trees that have that hole option. 
-                if (isinstance(hole_option.sketch_AST, ast.Name)):
-                    selected_group = group_dict[f'Name-{ast.unparse(hole_option.sketch_AST)}']
-                elif (isinstance(hole_option.sketch_AST, ast.Constant)):
-                    selected_group = group_dict[f'Constant-{ast.unparse(hole_option.sketch_AST)}']
+                if (isinstance(hole_option.sketch_AST, (ast.Name, ast.Constant))):
+                    group_num = list(group_dict).index(group_key(hole_option.sketch_AST))
                 else: 
-                    selected_group = group_dict[list(group_dict)[option_num]]
-                # Trees that have the selection option in the selected hole. 
-                new_trees = selected_reverse_sketch.recover_groups(hole_num, selected_group)
-                # Create new reverse sketches.
-                _, new_reverse_sketches = trees_uppper_bounds(new_trees)
+                    group_num = option_num
+                selected_group = group_dict[list(group_dict)[group_num]]
+                # Create new reverse sketches of the trees that have the selected option; precomputed ones are looked up. 
+                new_reverse_sketches = selected_reverse_sketch.refine(hole_num, group_num, selected_group, workspace.ids)
                 # Update the clickable options. 
                 for sketch in new_reverse_sketches:
                     # Update the clickable sketch.
-                    sketch.update_clickable_sketch(createClickableSketch(host, version, sketch.id, ast.unparse(sketch.sketch_AST)))
+                    sketch.update_clickable_sketch(createClickableSketch(host, version, sketch.id, unparse(sketch.sketch_AST)))
                     # Update the parent data. 
                     sketch.update_parent_data(selected_reverse_sketch.id, hole_num, option_num)
                 # Update the list of new sketches. 
                 new_sketches.extend(new_reverse_sketches)
-                # Add the new sketch to the REVERSE SKETCHES. 
-                REVERSE_SKETCHES_HISTORY_OBJS.extend(new_sketches)
-                # Update the sketch history array by adding the current sketches 
-                REVERSE_SKETCHES_HISTORY.extend([obj.generate_json() for obj in new_sketches])
+            # Register the new sketches in the history, once. 
+            workspace.history.extend(new_sketches)
+        # Pin the selected sketch, its ancestors and its new children. 
+        workspace.history.set_path(selected_reverse_sketch, new_sketches)
         print("New sketches: ", list(map(lambda x: x, new_sketches)))
         return new_sketches
    
@@ -815,23 +2853,24 @@ def get_hole(sketch_id, hole_id):
         key_counter = 0
         color_key_map = dict()
         color_value_map = dict()
+        count_value_map = dict()
         group_dict, hole_options = selected_reverse_sketch.expand_hole(hole_num, see_groups=True)
         # If its a concrete program....
         if len(hole_options) > 1:
             for k,v in group_dict.items(): 
                 # Assign the key color. 
                 if (hole_options[key_counter] not in color_key_map):
-                    color_key_map[ast.unparse(hole_options[key_counter].sketch_AST)] = COLORS[color_counter]
+                    color_key_map[unparse(hole_options[key_counter].sketch_AST)] = COLORS[color_counter]
                 # Assing each value a color. 
-                for tree_id, tree in enumerate(selected_reverse_sketch.trees):
-                    tree_substitution = selected_reverse_sketch.subs[tree_id][f"x_{hole_id}"]
-                    if tree_substitution in v: 
-                        color_value_map.setdefault(ast.unparse(tree), COLORS[color_counter])
+                for tree_id in selected_reverse_sketch.option_tree_ids(hole_id, v):
+                    tree = selected_reverse_sketch.trees[tree_id]
+                    color_value_map.setdefault(unparse_program(tree), COLORS[color_counter])
+                    count_value_map.setdefault(unparse_program(tree), selected_reverse_sketch.counts[tree_id])
                 # Update hte counters for the hole options and the colors. 
                 key_counter += 1
                 color_counter += 1
         print("Color key map: ", color_key_map)
-        return color_key_map, color_value_map
+        return color_key_map, color_value_map, count_value_map
 
     # Host link.
     host = "http://127.0.0.1:5000/"
@@ -842,23 +2881,23 @@ def get_hole(sketch_id, hole_id):
     # The Reverse Sketch class instance of the selected sketch. 
     selected_reverse_sketch = findObjByID(sketch_id)
     # If the reverse sketches are empty, abort. 
-    if not len(REVERSE_SKETCHES) or not selected_reverse_sketch_json:
+    if not len(workspace.reverse_sketches) or not selected_reverse_sketch_json:
         abort(404)
     else: 
         # Create Reverse Sketches for the filled options. 
         new_reverse_sketches = generate_new_sketches(selected_reverse_sketch, hole_id)
         # Create filled and spaces hole options. 
         if len(new_reverse_sketches) == 1:
-            filled_spaced_options = [ast.unparse(new_reverse_sketches[0].sketch_AST)]
+            filled_spaced_options = [unparse(new_reverse_sketches[0].sketch_AST)]
             filled_spaced_options = []
         else:
-            filled_spaced_options: list[str] = [createSketchWithFilledSpacedHole(host, version, hole_id, new_reverse_sketches,sketch_id, selected_reverse_sketch_json['sketch_str'], option_idx, option) for option_idx, option in enumerate(selected_reverse_sketch_json['subs'][hole_id])]
+            filled_spaced_options: list[str] = [createSketchWithFilledSpacedHole(host, version, hole_id, new_reverse_sketches,sketch_id, selected_reverse_sketch_json['sketch_str'], option_idx, option) for option_idx, option in enumerate(selected_reverse_sketch.hole_option_strs(hole_id))]
         # Retrieve all of the option ids. 
         new_reverse_sketches_id = [findJsonByParentData(sketch_id, hole_id, option_num).id for option_num in range(len(filled_spaced_options))]
         # Update the selected sketch's children attribute. 
         selected_reverse_sketch.update_children(new_reverse_sketches_id)
         # Generate a color map. 
-        color_key_map, color_value_map = generate_color_map(selected_reverse_sketch, hole_num=hole_id)
+        color_key_map, color_value_map, count_value_map = generate_color_map(selected_reverse_sketch, hole_num=hole_id)
         # Pretty print the entire space of programs. 
         overview_tree = pretty_print_children()
         
@@ -867,19 +2906,22 @@ def get_hole(sketch_id, hole_id):
         html_overview = generate_navigation3(overview_tree, selected_reverse_sketch.clickable_sketch, color_key_map)
         html_overview += "</ul></div>"
         print("Html overview: ", html_overview)    
+        # Expand the other holes of the sketch, and the holes of its options, while the page is read. 
+        workspace.prefetch([selected_reverse_sketch] + new_reverse_sketches)
         return render_template("options.html", 
                 selected_sketch=createClickableSketch2(host, version, sketch_id, selected_reverse_sketch_json['sketch_str'], hole_id),
                 # options_len=len(clickable_options), 
                 # options=clickable_options, 
                 options_len=len(filled_spaced_options), 
                 options=filled_spaced_options, 
-                prev_options_len=len(PREVIOUS_OPTIONS),
-                prev_options=PREVIOUS_OPTIONS,
+                prev_options_len=len(workspace.previous_options),
+                prev_options=workspace.previous_options,
                 len=len(selected_reverse_sketch.trees), 
                 programs=color_value_map, 
+                program_counts=count_value_map, 
                 colors=COLORS, 
-                history_len=len(REVERSE_SKETCHES_ORIGINAL),
-                prev_sketches=updateJsonStringReps(host, version, REVERSE_SKETCHES_ORIGINAL),
+                history_len=len(workspace.original),
+                prev_sketches=updateJsonStringReps(host, version, workspace.original),
                 overview=html_overview)
 
         # Horizontal tree
@@ -891,22 +2933,23 @@ def get_hole(sketch_id, hole_id):
         #         # options=clickable_options, 
         #         options_len=len(filled_spaced_options), 
         #         options=filled_spaced_options, 
-        #         prev_options_len=len(PREVIOUS_OPTIONS),
-        #         prev_options=PREVIOUS_OPTIONS,
+        #         prev_options_len=len(workspace.previous_options),
+        #         prev_options=workspace.previous_options,
         #         len=len(selected_reverse_sketch.trees), 
         #         programs=color_value_map, 
         #         colors=COLORS, 
-        #         history_len=len(REVERSE_SKETCHES_ORIGINAL),
-        #         prev_sketches=updateJsonStringReps(host, version, REVERSE_SKETCHES_ORIGINAL),
+        #         history_len=len(workspace.original),
+        #         prev_sketches=updateJsonStringReps(host, version, workspace.original),
         #         overview=html_overview)
 
 # TODO: Change to PUT
 @app.route('/oversynth/api/v1.0/sketches/<int:sketch_id>/<int:hole_num>/<int:option_num>', methods=['GET'])
+@with_workspace
 def update_hole(sketch_id, hole_num, option_num):
-    global REVERSE_SKETCHES
-    global REVERSE_SKETCHES_OBJS
-    global REVERSE_SKETCHES_HISTORY
-    global REVERSE_SKETCHES_ORIGINAL
+    # The requesting session's state. 
+    workspace = current_workspace()
+    # The user moved on; drop what was prefetched for the previous page. 
+    workspace.cancel_prefetches()
 
     '''
     Generate new sketches that represent the sketch with a filled hole.   
@@ -918,13 +2961,11 @@ def update_hole(sketch_id, hole_num, option_num):
         group_dict, hole_options = selected_reverse_sketch.expand_hole(hole_num, see_groups=True)
         # Retrieve trees that match the hole options.
         if (all(isinstance(x.sketch_AST, ast.Constant) for x in hole_options)):
-            # Retrieve the selected constant.
-            selected_constant = ((findJsonByID(sketch_id)['subs'])[hole_num])[option_num]
-            # Find all of the hole options that equal that constant and update the selected group.
-            selected_group = group_dict[f'Constant-{selected_constant}']
+            # Find all of the hole options that equal the selected constant and update the selected group.
+            group_num = list(group_dict).index(group_key(hole_options[option_num].sketch_AST))
         else: 
-            selected_group = group_dict[list(group_dict)[option_num]]
-        return selected_group
+            group_num = option_num
+        return group_num, group_dict[list(group_dict)[group_num]]
 
     # Host link.
     host = "http://127.0.0.1:5000/"
@@ -935,13 +2976,19 @@ def update_hole(sketch_id, hole_num, option_num):
     # The Reverse Sketch class instance of the selected sketch. 
     selected_reverse_sketch = findObjByID(sketch_id)
     # 
-    if len(REVERSE_SKETCHES) and selected_reverse_sketch:
-        # Generate the selected group.
-        selected_group = generate_new_sketches(selected_reverse_sketch)
-        # Trees that have the selection option in the selected hole. 
-        new_trees = selected_reverse_sketch.recover_groups(hole_num, selected_group)
-        # Create new reverse sketches.
-        _, new_reverse_sketches = trees_uppper_bounds(new_trees)
+    if len(workspace.reverse_sketches) and selected_reverse_sketch:
+        # The option was opened before: reuse its sketches and their ids. 
+        new_reverse_sketches = workspace.history.get_children(sketch_id, hole_num, option_num)
+        if new_reverse_sketches is None:
+            # Generate the selected group.
+            group_num, selected_group = generate_new_sketches(selected_reverse_sketch)
+            # Create new reverse sketches of the trees that have the selected option; precomputed ones are looked up. 
+            new_reverse_sketches = selected_reverse_sketch.refine(hole_num, group_num, selected_group, workspace.ids)
+            for sketch in new_reverse_sketches:
+                # Update the clickable sketch.
+                sketch.update_clickable_sketch(createClickableSketch(host, version, sketch.id, unparse(sketch.sketch_AST)))
+                # Update the parent data. 
+                sketch.update_parent_data(sketch_id, hole_num, option_num)
         # Store the class instance of the new reverse sketch. 
         new_reverse_sketch = new_reverse_sketches[0]
         # Generate JSON representation of the new reverse sketch. 
@@ -951,34 +2998,86 @@ def update_hole(sketch_id, hole_num, option_num):
         # Pretty print the children. 
         print("New clickable reverse sketch: ", clickable_new_reverse_sketch)
         # pretty_print_children()
-        # Update the sketch history array by adding the current sketches 
-        REVERSE_SKETCHES_HISTORY.extend([obj.generate_json() for obj in new_reverse_sketches])
-        # Update the sketch history array by adding the current sketches Reverse Sketch class instance.  
-        REVERSE_SKETCHES_HISTORY_OBJS.extend([obj for obj in new_reverse_sketches])
+        # Register the new sketches in the history. 
+        workspace.history.extend(new_reverse_sketches)
+        # Pin the selected sketch, its ancestors and the new sketches. 
+        workspace.history.set_path(selected_reverse_sketch, new_reverse_sketches)
         # Exrend the list Reverse Sketch class instances.  
-        REVERSE_SKETCHES_OBJS = [obj for obj in new_reverse_sketches]
+        workspace.reverse_sketches_objs = [obj for obj in new_reverse_sketches]
         # Extend the list of JSON objects that represent reverse sketches. 
-        REVERSE_SKETCHES = [obj.generate_json() for obj in new_reverse_sketches]
+        workspace.reverse_sketches = [obj.generate_json() for obj in new_reverse_sketches]
         color_dict = dict()
-        for tree in new_reverse_sketch.trees: 
-            color_dict[ast.unparse(tree)] = COLORS[0]
+        count_dict = dict()
+        for tree, count in zip(new_reverse_sketch.trees, new_reverse_sketch.counts): 
+            color_dict[unparse_program(tree)] = COLORS[0]
+            count_dict[unparse_program(tree)] = count
+        # Expand the holes of the new sketch while the page is read. 
+        workspace.prefetch(new_reverse_sketches)
         # Return the new skecth with programs that match it. 
         return render_template("options.html",
                 selected_sketch=clickable_new_reverse_sketch,
                 options_len=0, 
                 options=[], 
                 prev_options_len=0,
-                prev_options=PREVIOUS_OPTIONS,
+                prev_options=workspace.previous_options,
                 len=len(new_reverse_sketch.trees), 
                 programs=color_dict, 
+                program_counts=count_dict, 
                 colors=COLORS, 
-                history_len=len(REVERSE_SKETCHES_ORIGINAL),
-                prev_sketches=updateJsonStringReps(host, version, REVERSE_SKETCHES_ORIGINAL))
-    return jsonify(REVERSE_SKETCHES)  
+                history_len=len(workspace.original),
+                prev_sketches=updateJsonStringReps(host, version, workspace.original))
+    return jsonify(workspace.reverse_sketches)  
+
+@app.route('/oversynth/api/v1.0/jobs', methods=['POST'])
+@with_workspace(create=True)
+def create_job():
+    # The requesting session's state. 
+    workspace = current_workspace()
+    # Load the sent candidates, or the server's, in the background. 
+    job = submit_load_job(request_candidate_lines(), workspace.ids)
+    # The session explores the new dataset once it is loaded. 
+    workspace.cancel_prefetches()
+    workspace.reset()
+    workspace.job = job
+    return job_response(job, 202)
+
+@app.route('/oversynth/api/v1.0/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    # Not tied to the session's lock, so polling never waits behind a request. 
+    job = JOBS.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job.status())
 
 @app.errorhandler(404)
 def not_found(error):
     return make_response(jsonify({'error': 'Not found'}), 404) 
 
+@app.cli.command("build-snapshot")
+@click.option("--input", "input_path", default=CANDIDATES_FILE, show_default=True, help="Candidate programs, one per line.")
+@click.option("--output", "output_path", default=SKETCH_STORE_FILE, show_default=True, help="Snapshot file to write.")
+@click.option("--engine", type=click.Choice(["recursive", "columnar"]), default=None, help="Anti-unification engine.")
+@click.option("--depth", type=int, default=LATTICE_DEPTH, show_default=True, help="Levels of hole options and refinements to precompute below the roots.")
+@click.option("--max-nodes", type=int, default=LATTICE_MAX_NODES, show_default=True, help="Maximum number of sketches to precompute.")
+def build_snapshot_command(input_path, output_path, engine, depth, max_nodes):
+    """Precompute the sketch lattice of the candidates into a snapshot."""
+    num_sketches, num_nodes = build_snapshot(input_path, output_path, engine, depth, max_nodes)
+    click.echo(f"Wrote {num_nodes} sketches ({num_sketches} root sketches) to {output_path}")
+
+'''
+Prepare the app for serving: load (or rebuild) the snapshot, or canonicalize 
+the candidates, now, not on the first request. Servers should load the app through it, e.g. 
+`flask --app "main2:create_app()" run` or `gunicorn "main2:create_app()"`. 
+@param 
+@return the Flask app. 
+'''
+def create_app() -> Flask:
+    if ALPHA_RENAME:
+        canonical_trees()
+    else:
+        sketch_store()
+    return app
+
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    # Sessions have their own workspaces, so requests can be served concurrently. 
+    create_app().run(debug=True, threaded=True)
\ No newline at end of file
@@ -0,0 +1,29 @@
+import os
+import sys
+from collections import OrderedDict
+import pytest
+
+# The app is a plain module at the repository root. 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main2
+
+# f(?, ?) with five options in each hole (there are six option colors), and a second root sketch. 
+CANDIDATES = [f"f({name}, {num})" for num, name in enumerate("abcde")] + ["x = 1", "y = 2"]
+
+@pytest.fixture
+def candidates_file(tmp_path):
+    path = tmp_path / "candidates.txt"
+    path.write_text("\n".join(CANDIDATES) + "\n")
+    return path
+
+@pytest.fixture
+def client(tmp_path, candidates_file, monkeypatch):
+    # A private dataset, snapshot and set of sessions; prefetching off so ids are deterministic. 
+    monkeypatch.setattr(main2, "CANDIDATES_FILE", str(candidates_file))
+    monkeypatch.setattr(main2, "SKETCH_STORE_FILE", str(tmp_path / "candidates.sketches"))
+    monkeypatch.setattr(main2, "SKETCH_STORE", None)
+    monkeypatch.setattr(main2, "PREFETCH_WORKERS", 0)
+    monkeypatch.setattr(main2, "WORKSPACES", OrderedDict())
+    monkeypatch.setattr(main2, "EXPANSION_CACHE", main2.ExpansionCache())
+    return main2.app.test_client()
@@ -0,0 +1,50 @@
+import ast
+import pytest
+import main2
+
+CANDIDATES = ["lambda q: q + 1", "lambda r: r + 1", "lambda r: r + 2", "f(x)", "def foo(a): return a"]
+
+@pytest.mark.parametrize("engine", ["recursive", "columnar"])
+def test_renamed_candidates_group_together(engine):
+    trees = [main2.alpha_canonicalize(ast.parse(x)) for x in CANDIDATES]
+    assert main2.fingerprint(trees[0]) == main2.fingerprint(trees[1])
+    groups, reverse_sketches = main2.trees_uppper_bounds(trees, engine)
+    lambdas, = [reverse_sketch for reverse_sketch in reverse_sketches if str(reverse_sketch).startswith("lambda")]
+    assert str(lambdas) == "lambda _0: _0 + ?"
+    assert list(lambdas.counts) == [2, 1]
+    # Programs are shown as written. 
+    assert [main2.unparse_program(tree) for tree in lambdas.trees] == ["lambda q: q + 1", "lambda r: r + 2"]
+
+def test_candidates_are_canonicalized_once(client, monkeypatch):
+    monkeypatch.setattr(main2, "ALPHA_RENAME", True)
+    monkeypatch.setattr(main2, "CANONICAL_TREES", None)
+    reads = []
+    read_trees = main2.read_trees
+    monkeypatch.setattr(main2, "read_trees", lambda file_name: reads.append(file_name) or read_trees(file_name))
+    for _ in range(2):
+        # A new session each time. 
+        client.delete_cookie("session")
+        assert client.get("/oversynth/api/v1.0/sketches").status_code == 200
+    assert len(main2.WORKSPACES) == 2
+    assert reads == [main2.CANDIDATES_FILE]
+
+def canonical(source):
+    return ast.unparse(main2.alpha_canonicalize(ast.parse(source)))
+
+def test_only_uses_of_a_binding_are_renamed():
+    # The comprehension's s is bound; the call's s is an input of the program. 
+    assert canonical("f(s) + [s for s in t]") == "f(s) + [_0 for _0 in t]"
+    assert canonical("f(u) + [u for u in t]") == "f(u) + [_0 for _0 in t]"
+    trees, counts = main2.dedup_trees([main2.alpha_canonicalize(ast.parse(x)) for x in ["f(s) + [s for s in t]", "f(u) + [u for u in t]"]])
+    assert counts == [1, 1]
+    # Shadowing bindings get their own placeholders; the first iterable is in the enclosing scope. 
+    assert canonical("lambda x: [x for x in x]") == "lambda _0: [_1 for _1 in _0]"
+    assert canonical("lambda a, b=a: a + b") == "lambda _0, _1=a: _0 + _1"
+    # Placeholders skip free names. 
+    assert canonical("lambda q: q + _0") == "lambda _1: _1 + _0"
+
+def test_declarations_follow_their_bindings():
+    assert canonical("def f(a):\n    def h():\n        nonlocal a\n        a = 1\n    return a") == "def f(_0):\n\n    def h():\n        nonlocal _0\n        _0 = 1\n    return _0"
+    assert canonical("def f(a):\n    global g\n    g = a") == "def f(_0):\n    global g\n    g = _0"
+    # Class attributes are not visible in methods, and keep their names. 
+    assert canonical("class C:\n    x = 1\n\n    def m(self):\n        return x") == "class C:\n    x = 1\n\n    def m(_0):\n        return x"
@@ -0,0 +1,19 @@
+import ast
+import pytest
+import main
+import main2
+
+PAIRS = [("f(x)", "f(x, y)"), ("a[1:2]", "a[1:2:3]"), ("x.a", "x.b"), ("f(k=1)", "f(j=1)")]
+
+@pytest.mark.parametrize("first, second", PAIRS)
+def test_bare_mismatches_hole_their_node(first, second):
+    trees = [ast.parse(first), ast.parse(second)]
+    for engine in ["recursive", "columnar"]:
+        _, (reverse_sketch,) = main2.trees_uppper_bounds(trees, engine)
+        assert "?" in str(reverse_sketch)
+    # main.py's compare_trees holes the same node. 
+    del_dict = main.compare_trees(trees[0], trees[1:], {})
+    assert list(del_dict) == list(main2.compare_trees(trees[0], trees[1:], {}))
+    assert "?" in main.generalize_tree(trees[0], del_dict)[1]
+    # The inputs are left as they were. 
+    assert [ast.unparse(tree) for tree in trees] == [first, second]
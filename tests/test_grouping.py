@@ -0,0 +1,10 @@
+import ast
+import bench_grouping
+import main
+
+def test_linear_grouping_matches_quadratic():
+    trees = [ast.parse(x) for x in bench_grouping.EXAMPLES * 3]
+    groups, _ = main.trees_uppper_bounds(trees)
+    color_dict = main.assign_colors(groups)
+    assert main.group_by_str(trees) == bench_grouping.quadratic_group_by_str(trees)
+    assert main.generate_color_tups(color_dict, trees) == bench_grouping.quadratic_generate_color_tups(color_dict, trees)
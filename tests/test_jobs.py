@@ -0,0 +1,63 @@
+import threading
+import time
+from collections import OrderedDict
+import pytest
+import main2
+
+SKETCHES = "/oversynth/api/v1.0/sketches"
+JOBS = "/oversynth/api/v1.0/jobs"
+
+@pytest.fixture
+def jobs(monkeypatch):
+    monkeypatch.setattr(main2, "JOBS", OrderedDict())
+    monkeypatch.setattr(main2, "JOB_POOL", None)
+    yield
+    if main2.JOB_POOL is not None:
+        main2.JOB_POOL.shutdown()
+
+def wait_for(client, location, state):
+    for _ in range(500):
+        status = client.get(location).get_json()
+        if status['state'] == state:
+            return status
+        time.sleep(0.01)
+    raise AssertionError(f"job never reached {state}: {status}")
+
+def test_job_runs_to_done(client, jobs, monkeypatch):
+    # Hold the job in its parsing state until released. 
+    release = threading.Event()
+    iter_trees = main2.iter_trees
+    def held_iter_trees(*args, **kwargs):
+        release.wait(5)
+        yield from iter_trees(*args, **kwargs)
+    monkeypatch.setattr(main2, "iter_trees", held_iter_trees)
+    response = client.post(JOBS, json={'candidates': ["f(a)", "f(b)", "x = 1"]})
+    assert response.status_code == 202
+    location = response.headers['Location']
+    assert response.get_json()['state'] in ("queued", "parsing")
+    wait_for(client, location, "parsing")
+    # The session's sketches are not ready yet. 
+    pending = client.get(SKETCHES)
+    assert pending.status_code == 202
+    assert pending.headers['Location'] == location
+    release.set()
+    status = wait_for(client, location, "done")
+    assert status['trees_parsed'] == 3 and status['groups_done'] == status['groups_total']
+    assert client.get(SKETCHES).status_code == 200
+    workspace, = main2.WORKSPACES.values()
+    assert sorted(str(sketch) for sketch in workspace.original_objs) == ["f(?)", "x = 1"]
+
+def test_failed_job_is_reported(client, jobs, monkeypatch):
+    def failing(*args, **kwargs):
+        raise ValueError("boom")
+    monkeypatch.setattr(main2, "trees_uppper_bounds", failing)
+    response = client.post(JOBS, data="f(a)\nf(b)\n", content_type="text/plain")
+    assert response.status_code == 202
+    status = wait_for(client, response.headers['Location'], "failed")
+    assert status['error'] == "boom"
+    failed = client.get(SKETCHES)
+    assert failed.status_code == 500
+    assert failed.get_json()['state'] == "failed"
+
+def test_unknown_job_is_not_found(client, jobs):
+    assert client.get(f"{JOBS}/missing").status_code == 404
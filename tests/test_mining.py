@@ -0,0 +1,41 @@
+import ast
+import bench_grouping
+import main
+
+def summary(intermediate_sketch):
+    return (intermediate_sketch.sketch, intermediate_sketch.support, intermediate_sketch.counts,
+            [ast.unparse(sub) for sub in intermediate_sketch.substitutions])
+
+def test_mined_sketches_of_the_examples():
+    trees = [ast.parse(x) for x in bench_grouping.EXAMPLES]
+    mined = main.mine_intermediate_sketches(trees)
+    assert [summary(x) for x in mined[:5]] == [
+        ("str.split(sep)[?]", 8, [2, 1, 1, 1, 1, 1, 1], ["1:3", "1:2", "0", "1", "2", "lo[1]", "lo[2]"]),
+        ("?[1:3]", 7, [2, 2, 1, 1, 1], ["str.split(sep)", "str", "str + str", "str + str1", "str2 + str"]),
+        ("str[?]", 7, [2, 1, 1, 1, 1, 1], ["1:3", "lo[1]:3", "lo[2]:3", "1:len('a')", "1:len('b')", "2:1"]),
+        ("str[?:3]", 4, [2, 1, 1], ["1", "lo[1]", "lo[2]"]),
+        ("str[1:?]", 4, [2, 1, 1], ["3", "len('a')", "len('b')"]),
+    ]
+    assert {x.sketch for x in mined[5:]} == {"str.split(sep)[1:?]", "str[lo[?]:3]", "(str + ?)[1:3]", "(? + str)[1:3]",
+                                             "str[1:len(?)]", "str.split(sep)[lo[?]]"}
+    # Each substitution is the subexpression of its tree that the hole stands for. 
+    for x in mined:
+        assert x.support == sum(x.counts) >= 2
+        for tree, sub in zip(x.trees, x.substitutions):
+            assert any(node is sub for node in ast.walk(tree))
+            assert main.fingerprint(main.PatternGeneralizer({sub: []}).visit(tree)) == main.fingerprint(x.sketch_AST)
+
+def test_holed_fingerprints_match_the_holed_trees():
+    for source in bench_grouping.EXAMPLES:
+        tree = ast.parse(source)
+        for fp, sub in main.holed_fingerprints(tree):
+            generalizer = main.PatternGeneralizer({sub: []})
+            assert main.fingerprint(generalizer.visit(tree)) == fp
+
+def test_excluded_holes():
+    # A hole over a whole statement matches everything. 
+    assert main.mine_intermediate_sketches([ast.parse(x) for x in ["x", "y", "f(a)", "g(b)"]]) == []
+    # f-string parts can't be holes; their contents can. 
+    assert main.mine_intermediate_sketches([ast.parse(x) for x in ['f"{a}!"', 'f"{a}."']]) == []
+    mined = main.mine_intermediate_sketches([ast.parse(x) for x in ['f"{a}!"', 'f"{b}!"']])
+    assert [summary(x) for x in mined] == [("f'{?}!'", 2, [1, 1], ["a", "b"])]
@@ -0,0 +1,21 @@
+import ast
+import pytest
+import bench_grouping
+import main2
+
+CANDIDATES = bench_grouping.EXAMPLES + ["x = 1", "y = 2", "def foo(a): return a", "def foo(b): return 1", "f(a, 1)", "g(b)"]
+
+def sketches(reverse_sketches):
+    return [(reverse_sketch.id, str(reverse_sketch), list(reverse_sketch.counts),
+             [main2.unparse(tree) for tree in reverse_sketch.trees],
+             [reverse_sketch.hole_option_strs(hole_num) for hole_num in range(len(reverse_sketch.holes))])
+            for reverse_sketch in reverse_sketches]
+
+@pytest.mark.parametrize("engine", ["recursive", "columnar"])
+def test_parallel_matches_sequential(engine):
+    trees = [ast.parse(x) for x in CANDIDATES * 2]
+    groups, sequential = main2.trees_uppper_bounds(trees, engine, ids=iter(range(100)))
+    parallel_groups, parallel = main2.trees_uppper_bounds(trees, engine, workers=2, ids=iter(range(100)))
+    assert len(groups) > 1
+    assert list(parallel_groups) == list(groups)
+    assert sketches(parallel) == sketches(sequential)
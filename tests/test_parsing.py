@@ -0,0 +1,27 @@
+import ast
+import logging
+import pytest
+import main2
+
+LINES = ["f(a)", "", "f(", "   ", "x = 1", "def (:", "str[1:3]", "g(b)", "y = 2"]
+
+@pytest.fixture
+def lines_file(tmp_path):
+    path = tmp_path / "lines.txt"
+    path.write_text("\n".join(LINES) + "\n")
+    return str(path)
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_bad_and_blank_lines_are_skipped_in_order(lines_file, workers, monkeypatch, caplog):
+    monkeypatch.setattr(main2, "PARSE_WORKERS", workers)
+    with caplog.at_level(logging.WARNING, logger=main2.__name__):
+        # Small chunks, so that the lines are spread over several (parallel) chunks. 
+        chunks = list(main2.iter_trees(lines_file, chunk_size=2))
+    assert [ast.unparse(tree) for trees in chunks for tree in trees] == ["f(a)", "x = 1", "str[1:3]", "g(b)", "y = 2"]
+    assert len(chunks) == 4
+    # Line numbers are the file's, blank lines included. 
+    assert [record.getMessage().split(":")[0] for record in caplog.records] == [f"Skipping line 3 of {lines_file}", f"Skipping line 6 of {lines_file}"]
+
+def test_read_trees_reads_every_chunk(lines_file, monkeypatch):
+    monkeypatch.setattr(main2, "PARSE_CHUNK_SIZE", 1)
+    assert [ast.unparse(tree) for tree in main2.read_trees(lines_file)] == ["f(a)", "x = 1", "str[1:3]", "g(b)", "y = 2"]
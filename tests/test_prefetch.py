@@ -0,0 +1,61 @@
+import ast
+import threading
+from concurrent.futures import wait
+import main2
+
+SKETCHES = "/oversynth/api/v1.0/sketches"
+
+def explore(client):
+    urls = [SKETCHES, f"{SKETCHES}/0/0", f"{SKETCHES}/0/1", f"{SKETCHES}/0/1/2", SKETCHES]
+    seen = []
+    for url in urls:
+        assert client.get(url).status_code == 200
+        workspace, = main2.WORKSPACES.values()
+        # Let the prefetches of the page finish before the next click. 
+        wait(workspace.prefetches)
+        seen.append(sorted((sketch.id, str(sketch)) for sketch in workspace.history))
+    return seen
+
+def test_prefetch_takes_no_ids(client, monkeypatch):
+    without_prefetch = explore(client)
+    monkeypatch.setattr(main2, "WORKSPACES", main2.OrderedDict())
+    monkeypatch.setattr(main2, "EXPANSION_CACHE", main2.ExpansionCache())
+    monkeypatch.setattr(main2, "PREFETCH_WORKERS", 2)
+    monkeypatch.setattr(main2, "PREFETCH_POOL", None)
+    try:
+        assert explore(main2.app.test_client()) == without_prefetch
+        assert main2.EXPANSION_CACHE.stats()['hits'] > 0
+    finally:
+        main2.PREFETCH_POOL.shutdown()
+
+class PausingRows(list):
+    # Sub id rows that stop a prefetch thread after the first row until released. 
+    def __init__(self, rows):
+        super().__init__(rows)
+        self.building = threading.Event()
+        self.release = threading.Event()
+
+    def __iter__(self):
+        for row_num, row in enumerate(super().__iter__()):
+            if row_num == 1 and threading.current_thread().name.startswith("prefetch"):
+                self.building.set()
+                self.release.wait(5)
+            yield row
+
+def test_click_during_prefetch_sees_a_whole_index(monkeypatch):
+    monkeypatch.setattr(main2, "EXPANSION_CACHE", main2.ExpansionCache())
+    monkeypatch.setattr(main2, "PREFETCH_WORKERS", 2)
+    monkeypatch.setattr(main2, "PREFETCH_POOL", None)
+    _, (reverse_sketch,) = main2.trees_uppper_bounds([ast.parse(f"f({name}, {num})") for num, name in enumerate("abcde")])
+    reverse_sketch.sub_ids = rows = PausingRows(reverse_sketch.sub_ids)
+    try:
+        futures = main2.prefetch_expansions([reverse_sketch])
+        assert rows.building.wait(5)
+        # The prefetch is halfway through the index; the click on the second hole still finds every tree. 
+        assert reverse_sketch.recover_groups(1, [reverse_sketch.sub_table[reverse_sketch.sub_ids[1][2]]]) == [reverse_sketch.trees[2]]
+        rows.release.set()
+        wait(futures)
+        assert len(reverse_sketch.get_hole_index()) == 2
+    finally:
+        rows.release.set()
+        main2.PREFETCH_POOL.shutdown()
@@ -0,0 +1,58 @@
+import ast
+import main2
+
+SKETCHES = "/oversynth/api/v1.0/sketches"
+
+def session_history():
+    workspace, = main2.WORKSPACES.values()
+    return workspace.history
+
+def root_id(client, sketch_str):
+    assert client.get(SKETCHES).status_code == 200
+    return next(sketch.id for sketch in session_history() if str(sketch) == sketch_str)
+
+def test_revisited_hole_reuses_children(client):
+    sketch_id = root_id(client, "f(?, ?)")
+    assert client.get(f"{SKETCHES}/{sketch_id}/0").status_code == 200
+    children = [session_history().get_child(sketch_id, 0, option_num).id for option_num in range(5)]
+    assert client.get(f"{SKETCHES}/{sketch_id}/0").status_code == 200
+    assert [session_history().get_child(sketch_id, 0, option_num).id for option_num in range(5)] == children
+    # Opening an option shows the sketches its hole link pointed to. 
+    assert client.get(f"{SKETCHES}/{sketch_id}/0/3").status_code == 200
+    workspace, = main2.WORKSPACES.values()
+    assert [sketch.id for sketch in workspace.reverse_sketches_objs] == [children[3]]
+
+def test_evicted_hole_is_regenerated(client, monkeypatch):
+    monkeypatch.setattr(main2, "HISTORY_SIZE", 12)
+    sketch_id = root_id(client, "f(?, ?)")
+    history = session_history()
+    assert history.maxsize == 12
+    seen = set()
+    for _ in range(3):
+        for hole_num in range(2):
+            # The other hole's options were evicted to make room for this one's. 
+            assert client.get(f"{SKETCHES}/{sketch_id}/{hole_num}").status_code == 200
+            assert len(history) <= 12
+            seen.update(sketch.id for sketch in history)
+            for option_num in range(5):
+                child = history.get_child(sketch_id, hole_num, option_num)
+                assert child is not None and child.id in history
+                assert child.parent_data == {'sketch_id': sketch_id, 'hole_num': hole_num, 'option_num': option_num}
+    # Regenerated options get new ids. 
+    assert len(seen) > 12
+
+def test_eviction_drops_sibling_index():
+    registry = main2.SketchRegistry(maxsize=3)
+    trees = [ast.parse(x) for x in ["f(a, 1)", "f(b, 2)", "f(c, 3)"]]
+    _, roots = main2.trees_uppper_bounds(trees)
+    registry.add_roots(roots)
+    children = [main2.antiunfy([tree]) for tree in trees]
+    for option_num, child in enumerate(children):
+        child.update_parent_data(roots[0].id, 0, 0 if option_num < 2 else 1)
+    registry.extend(children)
+    assert [child.id for child in registry.get_children(roots[0].id, 0, 0)] == [children[0].id, children[1].id]
+    # Only the roots and the viewed sketch are pinned, so an older sibling goes. 
+    registry.set_path(children[2])
+    assert len(registry) == 3
+    assert registry.get_children(roots[0].id, 0, 0) is None
+    assert [child.id for child in registry.get_children(roots[0].id, 0, 1)] == [children[2].id]
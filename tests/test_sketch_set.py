@@ -0,0 +1,52 @@
+import ast
+import pytest
+import main2
+
+CANDIDATES = [
+    "str.split(sep)[1:3]",
+    "str[1:3]",
+    "str[lo[1]:3]",
+    "(str + str1)[1:3]",
+    "str[1:len('a')]",
+    "str.split(sep)[0]",
+    "str.split(sep)[lo[2]]",
+    "a[1:2]",
+    "a[1:2:3]",
+    "f(a)",
+    "f(a, b)",
+    "f(a, b, c)",
+    "f(x, k=1)",
+    "g(x, y)",
+]
+
+def sketch_summary(reverse_sketch):
+    subs = [{hole: main2.unparse(tree) for hole, tree in sub.items()} for sub in reverse_sketch.subs]
+    return str(reverse_sketch), subs, list(reverse_sketch.counts)
+
+def batch_summary(trees, engine):
+    _, reverse_sketches = main2.trees_uppper_bounds(trees, engine)
+    return sorted(sketch_summary(reverse_sketch) for reverse_sketch in reverse_sketches)
+
+def incremental_summary(trees, engine):
+    _, reverse_sketches = main2.SketchSet(trees, engine).upper_bounds()
+    return sorted(sketch_summary(reverse_sketch) for reverse_sketch in reverse_sketches)
+
+@pytest.mark.parametrize("engine", ["recursive", "columnar"])
+def test_optional_slice_step_matches_batch(engine):
+    trees = [ast.parse(x) for x in ["a[1:2]", "a[1:2:3]"]]
+    assert incremental_summary(trees, engine) == batch_summary(trees, engine)
+    (sketch, subs, _), = incremental_summary(trees, engine)
+    assert sketch == "a[?]"
+    assert subs == [{"x_0": "1:2"}, {"x_0": "1:2:3"}]
+
+@pytest.mark.parametrize("engine", ["recursive", "columnar"])
+def test_incremental_matches_batch(engine):
+    trees = [ast.parse(x) for x in CANDIDATES]
+    assert incremental_summary(trees, engine) == batch_summary(trees, engine)
+
+def test_duplicates_only_bump_counts():
+    trees = [ast.parse(x) for x in ["f(a)", "f(b)", "f(a)"]]
+    (sketch, subs, counts), = incremental_summary(trees, None)
+    assert sketch == "f(?)"
+    assert subs == [{"x_0": "a"}, {"x_0": "b"}]
+    assert counts == [2, 1]
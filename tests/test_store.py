@@ -0,0 +1,86 @@
+import threading
+from collections.abc import Sequence
+import ast
+import pytest
+import main2
+
+CANDIDATES = [
+    "x = 1",
+    "y = 2",
+    "def foo(a): return a",
+    "str.split(sep)[1:3]",
+    "str[1:3]",
+    "f(1.5, 2j, b'x', True, None)",
+]
+
+@pytest.fixture
+def store(tmp_path):
+    trees = [ast.parse(x) for x in CANDIDATES]
+    path = str(tmp_path / "candidates.sketches")
+    main2.build_sketch_store(trees, path)
+    return main2.MappedSketchStore(path)
+
+def test_roots_round_trip(store):
+    _, reverse_sketches = main2.trees_uppper_bounds([ast.parse(x) for x in CANDIDATES])
+    stored = store.root_sketches(iter(range(len(reverse_sketches))))
+    assert store.num_sketches == len(reverse_sketches)
+    assert sorted(str(reverse_sketch) for reverse_sketch in stored) == sorted(str(reverse_sketch) for reverse_sketch in reverse_sketches)
+    # Stored programs unparse like the parsed ones, statements included. 
+    programs = [main2.unparse(tree) for reverse_sketch in stored for tree in reverse_sketch.trees]
+    assert sorted(programs) == sorted(ast.unparse(ast.parse(x)) for x in CANDIDATES)
+
+def test_unrelated_calls_build(tmp_path):
+    path = str(tmp_path / "calls.sketches")
+    num_roots, num_nodes = main2.build_sketch_store([ast.parse(x) for x in ["f(x)", "g(x, y)"]], path)
+    store = main2.MappedSketchStore(path)
+    root, = store.root_sketches(iter(range(num_nodes)))
+    assert num_roots == 1 and str(root) == "?"
+    assert sorted(main2.unparse(tree) for tree in root.trees) == ["f(x)", "g(x, y)"]
+    assert root.hole_option_strs(0)
+
+def test_failed_expansion_is_left_out(tmp_path, monkeypatch):
+    compute_expansion = main2.ReverseSketch.compute_expansion
+    def failing(reverse_sketch, hole_num):
+        if hole_num == 1:
+            raise AttributeError("boom")
+        return compute_expansion(reverse_sketch, hole_num)
+    monkeypatch.setattr(main2.ReverseSketch, "compute_expansion", failing)
+    path = str(tmp_path / "failing.sketches")
+    main2.build_sketch_store([ast.parse(x) for x in ["f(a, 1)", "f(b, 2)"]], path)
+    store = main2.MappedSketchStore(path)
+    assert store.expansion(0, 0) is not None
+    # The failed hole is expanded on request instead. 
+    assert store.expansion(0, 1) is None
+
+def test_create_app_loads_snapshot(tmp_path, candidates_file, monkeypatch):
+    monkeypatch.setattr(main2, "CANDIDATES_FILE", str(candidates_file))
+    monkeypatch.setattr(main2, "SKETCH_STORE_FILE", str(tmp_path / "candidates.sketches"))
+    monkeypatch.setattr(main2, "SKETCH_STORE", None)
+    assert main2.create_app() is main2.app
+    assert main2.SKETCH_STORE is not None
+    assert (tmp_path / "candidates.sketches").exists()
+
+def test_lookup_during_another_sessions_build(store):
+    reverse_sketch = next(sketch for sketch in store.root_sketches(iter(range(100))) if sketch.holes)
+    sub_table = reverse_sketch.sub_lookup.sub_table
+    building, release = threading.Event(), threading.Event()
+    class PausingTable(Sequence):
+        # Stops session A halfway through the table until released. 
+        def __getitem__(self, index):
+            if index == 1 and threading.current_thread().name == "session-a":
+                building.set()
+                release.wait(5)
+            return sub_table[index]
+        def __len__(self):
+            return len(sub_table)
+    reverse_sketch.sub_lookup.sub_table = PausingTable()
+    session_a = threading.Thread(target=reverse_sketch.sub_lookup.lookup, name="session-a")
+    session_a.start()
+    try:
+        assert building.wait(5)
+        # Session B clicks the last option while A is building the shared table. 
+        sub_id = len(sub_table) - 1
+        assert reverse_sketch.option_tree_ids(0, [sub_table[sub_id]]) == reverse_sketch.get_hole_index()[0][sub_id]
+    finally:
+        release.set()
+        session_a.join()
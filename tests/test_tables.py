@@ -0,0 +1,47 @@
+import ast
+import main2
+
+CANDIDATES = ["str.split(sep)[1:3]", "str[1:3]", "str[lo[1]:3]", "(str + str1)[1:3]", "str[1:len('a')]", "f(a, b)", "f(a)"]
+
+def test_lru_table_keeps_recent_entries():
+    table = main2.LRUTable(2)
+    assert table.setdefault("a", 1) == 1
+    assert table.setdefault("a", 2) == 1
+    table.setdefault("b", 2)
+    assert table.get("a") == 1
+    table.setdefault("c", 3)
+    assert len(table) == 2
+    assert table.get("b") is None and table.get("a") == 1 and table.get("c") == 3
+
+def test_fingerprints_depend_on_structure_only():
+    fingerprints = {}
+    for tree in [ast.parse(x) for x in CANDIDATES * 2]:
+        for node in ast.walk(tree):
+            fingerprints.setdefault(main2.fingerprint(node), set()).add(ast.dump(node))
+    assert all(len(dumps) == 1 for dumps in fingerprints.values())
+    # Freshly parsed (or decoded) copies get the fingerprints of the first ones. 
+    assert [main2.fingerprint(ast.parse(x)) for x in CANDIDATES] == [main2.fingerprint(ast.parse(x)) for x in CANDIDATES]
+    assert len({main2.fingerprint(x) for x in [1, 1.0, True, 0.0, -0.0, "1", b"1", None, [], [None]]}) == 10
+
+def test_stored_options_recover_their_trees(tmp_path, monkeypatch):
+    monkeypatch.setattr(main2, "GROUP_KEYS", main2.LRUTable(4))
+    monkeypatch.setattr(main2, "UNPARSED", main2.LRUTable(4))
+    path = str(tmp_path / "candidates.sketches")
+    main2.build_sketch_store([ast.parse(x) for x in CANDIDATES], path)
+    store = main2.MappedSketchStore(path)
+    for reverse_sketch in store.root_sketches(iter(range(100))):
+        for hole_num in range(len(reverse_sketch.holes)):
+            # An unrelated dataset in between; stored sketches decode fresh nodes on every access. 
+            main2.trees_uppper_bounds([ast.parse(f"g({i}, h{i})") for i in range(50)])
+            index = reverse_sketch.get_hole_index()[hole_num]
+            for sub_id, tree_ids in index.items():
+                assert reverse_sketch.option_tree_ids(hole_num, [reverse_sketch.sub_table[sub_id]]) == tree_ids
+
+def test_sketches_do_not_depend_on_table_size(monkeypatch):
+    def sketches():
+        _, reverse_sketches = main2.trees_uppper_bounds([ast.parse(x) for x in CANDIDATES])
+        return sorted((str(reverse_sketch), reverse_sketch.hole_option_strs(0)) for reverse_sketch in reverse_sketches)
+    expected = sketches()
+    for name in ["GROUP_KEYS", "UNPARSED"]:
+        monkeypatch.setattr(main2, name, main2.LRUTable(4))
+    assert sketches() == expected
@@ -0,0 +1,23 @@
+import main2
+
+SKETCHES = "/oversynth/api/v1.0/sketches"
+
+def test_secret_key_is_generated_once(tmp_path, monkeypatch):
+    monkeypatch.delenv("OVERSYNTH_SECRET_KEY", raising=False)
+    path = str(tmp_path / "instance" / "secret_key")
+    key = main2.load_secret_key(path)
+    assert key and main2.load_secret_key(path) == key
+    monkeypatch.setenv("OVERSYNTH_SECRET_KEY", "from-env")
+    assert main2.load_secret_key(path) == "from-env"
+
+def test_requests_without_a_session_create_no_workspace(client):
+    for url in [f"{SKETCHES}/0", f"{SKETCHES}/0/0", f"{SKETCHES}/0/0/0", f"{SKETCHES}/0/0/options"]:
+        assert client.get(url).status_code == 404
+    assert not main2.WORKSPACES
+
+def test_sessions_keep_their_workspace(client):
+    assert client.get(SKETCHES).status_code == 200
+    workspace, = main2.WORKSPACES.values()
+    assert client.get(f"{SKETCHES}/0").status_code == 200
+    assert client.get(SKETCHES).status_code == 200
+    assert list(main2.WORKSPACES.values()) == [workspace]